@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Block model representations. Besides one polyhedral surface per block,
+# the blocks of each geological shape can be stored compactly as the shape
+# origin, the cube size, and a run-length encoding of its block indexes.
+
+from src.geometry import Hexahedron
+import numpy as np
+
+# Block faces, given as indexes into Hexahedron.CORNERS. This is the face
+# order used by MineWorkingCell.asBlock().
+BLOCK_FACES = [
+    [3, 0, 4, 5, 3],
+    [1, 2, 6, 7, 1],
+    [0, 3, 2, 1, 0],
+    [4, 7, 6, 5, 4],
+    [0, 1, 7, 4, 0],
+    [2, 3, 5, 6, 2]
+]
+
+# Format string of a block, taking the 8x3 corner coordinates as arguments
+BLOCK_TEMPLATE = "POLYHEDRALSURFACEZ({})".format(",".join(
+    "(({}))".format(",".join(
+        "{{{0}}} {{{1}}} {{{2}}}".format(3*c, 3*c+1, 3*c+2) for c in face))
+    for face in BLOCK_FACES))
+
+def blockArray(block_indexes):
+    """
+    Return the given (i, j, k) @block_indexes (an array or a sequence of
+    tuples) as an (N,3) integer array.
+    """
+    return np.asarray(block_indexes, dtype=np.int64).reshape(-1, 3)
+
+def encodeRuns(block_indexes, cube_size):
+    """
+    Run-length encode a list of (i, j, k) block indexes. Consecutive blocks
+    that share (i, j) and whose k grows by @cube_size are collapsed into a
+    single (i, j, k, length) run. Block order is preserved.
+    """
+    runs = []
+    for i, j, k in blockArray(block_indexes).tolist():
+        if len(runs) > 0:
+            ri, rj, rk, rlen = runs[-1]
+            if ri == i and rj == j and rk + rlen * cube_size == k:
+                runs[-1][3] += 1
+                continue
+        runs.append([i, j, k, 1])
+    return np.array(runs, dtype=np.int64).reshape(-1, 4)
+
+def decodeRuns(runs, cube_size):
+    """
+    Expand the output of encodeRuns() back into a list of block indexes.
+    """
+    block_indexes = []
+    for i, j, k, length in runs.tolist():
+        for n in range(length):
+            block_indexes.append((i, j, k + n * cube_size))
+    return block_indexes
+
+
+class BlockModel:
+    """
+    The block model of a single geological shape.
+    """
+    def __init__(self, origin, cube_size, block_indexes):
+        self.origin = origin
+        self.cube_size = cube_size
+        self.block_indexes = block_indexes
+        self.corner_array = None
+
+    @classmethod
+    def fromShape(cls, shape):
+        origin = (shape.seed.x, shape.seed.y, shape.seed.z)
+        return cls(origin, shape.cube_size, shape.block_indexes)
+
+    def blocks(self):
+        """
+        Return an (N,3) array with the (i, j, k) index of each block.
+        """
+        return blockArray(self.block_indexes)
+
+    def corners(self):
+        """
+        Return an (N,8,3) array with the corners of each block, ordered
+        as in Hexahedron.CORNERS. The arithmetic mirrors
+        MineWorkingCell.asBlock() so that the coordinates are bit-for-bit
+        identical.
+        """
+        if self.corner_array is not None:
+            return self.corner_array
+        size = self.cube_size
+        index = self.blocks().copy()
+        # The k axis grows downwards
+        index[:, 2] = -index[:, 2]
+        origins = index * size + np.asarray(self.origin) - size/2
+        offsets = np.array(Hexahedron.CORNERS, dtype=np.int64)
+        self.corner_array = origins[:, None, :] + offsets[None, :, :] * size
+        return self.corner_array
+
+    def bboxes(self):
+        """
+        Return an (N,6) array with the bounding box of each block.
+        """
+        corners = self.corners()
+        return np.concatenate([corners[:, 0, :], corners[:, 6, :]], axis=1)
+
+    def boxGeom(self, n):
+        """
+        WKT representation of the n-th block.
+        """
+        return BLOCK_TEMPLATE.format(*self.corners()[n].ravel().tolist())
+
+    def geoms(self):
+        """
+        Return the WKT representation of each block.
+        """
+        coords = self.corners().reshape(-1, 24).tolist()
+        return [BLOCK_TEMPLATE.format(*c) for c in coords]
+
+    def blockmodelGeom(self, postgis_output=True):
+        """
+        List of WKT strings representing all blocks of this model. Each
+        block is rendered exactly as MineWorkingCell.asBlock() would
+        render it.
+        """
+        geoms = self.geoms()
+        if postgis_output:
+            return "".join(
+                "('{}'){}\n".format(geom, "," if idx < len(geoms)-1 else "")
+                for idx, geom in enumerate(geoms))
+        return "".join("{}\n".format(geom) for geom in geoms)
+
+
+class BlockModelSet:
+    """
+    The block models of all shapes of a level. Exposes a @shapes attribute
+    so it can be handed to the block model writers in place of a MapGen.
+    """
+    def __init__(self, shapes):
+        self.shapes = shapes
+
+    def save(self, path):
+        """
+        Write the block models to @path in NumPy's .npz format.
+        """
+        origins = np.array([s.origin for s in self.shapes], dtype=np.float64)
+        cube_sizes = np.array([s.cube_size for s in self.shapes], dtype=np.int64)
+        runs = [encodeRuns(s.block_indexes, s.cube_size) for s in self.shapes]
+        run_offsets = np.cumsum([0] + [len(r) for r in runs], dtype=np.int64)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                origin=origins.reshape(-1, 3),
+                cube_size=cube_sizes,
+                run_offsets=run_offsets,
+                runs=np.concatenate(runs) if len(runs) else np.empty((0, 4)))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read block models previously written by save().
+        """
+        data = np.load(path)
+        origins = data["origin"].tolist()
+        cube_sizes = data["cube_size"].tolist()
+        offsets = data["run_offsets"].tolist()
+        runs = data["runs"].astype(np.int64)
+        shapes = []
+        for s, (origin, cube_size) in enumerate(zip(origins, cube_sizes)):
+            block_indexes = decodeRuns(runs[offsets[s]:offsets[s+1]], cube_size)
+            shapes.append(BlockModel(tuple(origin), cube_size, block_indexes))
+        return cls(shapes)
+
+    @classmethod
+    def fromMap(cls, the_map):
+        return cls([BlockModel.fromShape(shape) for shape in the_map.shapes])
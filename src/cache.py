@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Content-addressed cache of generated levels. Each entry holds the files
+# written for a level, keyed by a hash of everything the level depends on:
+# the relevant config settings, the seed, the level index, the output
+# settings, and the source code of the generator.
+
+import tempfile
+import hashlib
+import shutil
+import glob
+import json
+import os
+
+# Name of the file with the statistics of a cached level
+INFO_FILE = "level.json"
+
+def codeVersion():
+    """
+    Digest of the source files of the generator. Any change to the code
+    invalidates the cache.
+    """
+    digest = hashlib.sha256()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(src_dir, "*.py"))):
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode())
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def fileDigest(path):
+    """
+    Digest of the contents of @path.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def configDigest(cfg, sections):
+    """
+    Digest of the given @sections of @cfg. Files referenced by the
+    settings (e.g., DrillHoles.sizes_file) are hashed by contents.
+    """
+    settings = {}
+    for section in sections:
+        items = {}
+        for key, value in sorted(cfg.items(section)):
+            items[key] = value
+            if key.endswith("_file") and os.path.exists(value):
+                items[key] = fileDigest(value)
+        settings[section] = items
+    return hashlib.sha256(
+        json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+class LevelCache:
+    """
+    Directory with one subdirectory per cached level. The least recently
+    used levels are removed once the cache grows beyond @max_bytes.
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = codeVersion()
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, **parts):
+        """
+        Compute the key of a level out of the values it depends on.
+        """
+        parts["code_version"] = self.version
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def fetch(self, key, output_dir):
+        """
+        Copy the files of the level cached under @key to @output_dir.
+        Returns the statistics stored with the level, or None if @key
+        is not in the cache.
+        """
+        entry = os.path.join(self.path, key)
+        try:
+            with open(os.path.join(entry, INFO_FILE), "r") as f:
+                info = json.load(f)
+            for fname in info["files"]:
+                shutil.copyfile(
+                    os.path.join(entry, fname),
+                    os.path.join(output_dir, fname))
+            # Mark the entry as recently used
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return info
+
+    def store(self, key, files, **info):
+        """
+        Add the given level @files to the cache under @key, along with
+        the statistics in @info.
+        """
+        entry = os.path.join(self.path, key)
+        if os.path.exists(entry):
+            return
+        # Entries are assembled aside and renamed into place, so that
+        # concurrent generators never see a partial entry
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.path)
+        info["files"] = [os.path.basename(path) for path in files]
+        for path in files:
+            shutil.copyfile(path, os.path.join(tmp_dir, os.path.basename(path)))
+        with open(os.path.join(tmp_dir, INFO_FILE), "w") as f:
+            json.dump(info, f)
+        try:
+            os.rename(tmp_dir, entry)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits
+        within its size limit.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(entry, fname))
+                    for fname in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Exportable entities. Wraps the mine objects that end up as rows of the
+# output tables so that exporters can reason about where each geometry
+# lies before rendering it as WKT.
+
+from collections import OrderedDict
+from src.blockmodel import BlockModel, BLOCK_FACES
+from src.mesh import WallMesh
+import numpy as np
+
+# Tables whose entities are merged into a single geometry per output row
+MERGED_TABLES = OrderedDict([
+    ("mineworking", "POLYHEDRALSURFACEZ"),
+    ("multiline_drillholes", "MULTILINESTRINGZ")
+])
+
+class Entity:
+    """
+    Base class for a single geometry that is about to be exported.
+    """
+    def bbox(self):
+        """
+        Return the 3D bounding box of this geometry as a tuple
+        (xmin, ymin, zmin, xmax, ymax, zmax).
+        """
+        pass
+
+    def coords(self):
+        """
+        Textual coordinates of this geometry, suitable for merging
+        into a collection (e.g., MULTILINESTRINGZ).
+        """
+        pass
+
+    def wkt(self):
+        """
+        WKT representation of this geometry.
+        """
+        pass
+
+    def array(self):
+        """
+        Coordinates of this geometry as a NumPy array: (3,) for points,
+        (2,3) for lines, and (F,V,3) for surfaces made of F faces of V
+        vertices each (rings are not closed).
+        """
+        pass
+
+
+class CellEntity(Entity):
+    """
+    A corridor cell of the mine working. The textual coordinates and the
+    triangles of its walls may be given in @coords and @triangles when
+    they were already computed for all cells at once (see WallMesh).
+    """
+    def __init__(self, cell, coords=None, triangles=None):
+        self.cell = cell
+        self.cell_coords = coords
+        self.cell_triangles = triangles
+
+    def bbox(self):
+        floor = self.cell.points
+        ceiling = self.cell.points_ceiling
+        xs = [p[0] for p in floor]
+        ys = [p[1] for p in floor]
+        zs = [floor[0][2], ceiling[0][2]]
+        return (min(xs), min(ys), min(zs), max(xs), max(ys), max(zs))
+
+    def coords(self):
+        if self.cell_coords is None:
+            self.cell_coords = self.cell.coords()
+        return self.cell_coords
+
+    def wkt(self):
+        return "POLYHEDRALSURFACEZ({})".format(self.coords())
+
+    def array(self):
+        if self.cell_triangles is None:
+            # Cells on their own (i.e., the elevator) have all of their walls
+            walls = np.ones((1, len(WallMesh.WALLS)), dtype=bool)
+            self.cell_triangles = WallMesh([self.cell], walls).triangles()
+        return self.cell_triangles
+
+
+class LineEntity(Entity):
+    """
+    A drill hole or a drill hole segment.
+    """
+    def __init__(self, drill):
+        self.drill = drill
+
+    def bbox(self):
+        p1, p2 = self.drill.line.p1, self.drill.line.p2
+        return (
+            min(p1.x, p2.x), min(p1.y, p2.y), min(p1.z, p2.z),
+            max(p1.x, p2.x), max(p1.y, p2.y), max(p1.z, p2.z))
+
+    def coords(self):
+        return "({})".format(self.drill.line.coords())
+
+    def wkt(self):
+        return self.drill.geom()
+
+    def array(self):
+        p1, p2 = self.drill.line.p1, self.drill.line.p2
+        return np.array([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
+
+
+class PointEntity(Entity):
+    """
+    A drill hole collar or end point.
+    """
+    def __init__(self, point):
+        self.point = point
+
+    def bbox(self):
+        p = self.point
+        return (p.x, p.y, p.z, p.x, p.y, p.z)
+
+    def coords(self):
+        return "({})".format(self.point.coords())
+
+    def wkt(self):
+        return self.point.wkt()
+
+    def array(self):
+        return np.array([self.point.x, self.point.y, self.point.z])
+
+
+class ShapeEntity(Entity):
+    """
+    A geological shape, represented by its convex hull.
+    """
+    def __init__(self, shape):
+        self.shape = shape
+
+    def bbox(self):
+        points = self.shape.points
+        if self.shape.triangles is not None:
+            points = self.shape.triangles.reshape(-1, 3)
+        return tuple(points.min(axis=0)) + tuple(points.max(axis=0))
+
+    def coords(self):
+        return self.wkt()[len("POLYHEDRALSURFACEZ"):]
+
+    def wkt(self):
+        return self.shape.geom(postgis_output=False)
+
+    def array(self):
+        return self.shape.surface()
+
+
+class BlockEntity(Entity):
+    """
+    A single block of the block model of a geological shape.
+    """
+    def __init__(self, model, index):
+        self.model = model
+        self.index = index
+
+    def bbox(self):
+        corners = self.model.corners()[self.index]
+        return tuple(corners[0].tolist() + corners[6].tolist())
+
+    def coords(self):
+        return self.wkt()[len("POLYHEDRALSURFACEZ"):]
+
+    def wkt(self):
+        return self.model.boxGeom(self.index)
+
+    def array(self):
+        faces = np.array(BLOCK_FACES)[:, 0:-1]
+        return self.model.corners()[self.index][faces]
+
+
+def collect(the_map, table):
+    """
+    Return the list of entities that make up @table, in the same
+    order used by the exporters. The elevator, if any, is the last
+    entity of the mine working.
+    """
+    if table == "mineworking":
+        mesh = the_map.wallMesh()
+        cells = [
+            CellEntity(cell, coords, cell_triangles)
+            for cell, coords, cell_triangles in zip(
+                the_map.corridor, mesh.cellCoords(), mesh.cellTriangles())]
+        if the_map.elevator is not None:
+            cells.append(CellEntity(the_map.elevator))
+        return cells
+    elif table in ["drillholes", "multiline_drillholes"]:
+        return [LineEntity(drill) for drill in the_map.drills]
+    elif table == "segments":
+        return [
+            LineEntity(segment)
+            for drill in the_map.drills
+            for segment in drill.segments()]
+    elif table == "points":
+        return [
+            PointEntity(p)
+            for drill in the_map.drills
+            for p in [drill.line.p1, drill.line.p2]]
+    elif table == "geological_shapes":
+        return [ShapeEntity(shape) for shape in the_map.shapes]
+    elif table == "blockmodel":
+        models = [BlockModel.fromShape(shape) for shape in the_map.shapes]
+        return [
+            BlockEntity(model, n)
+            for model in models
+            for n in range(len(model.block_indexes))]
+    raise ValueError("unknown table '{}'".format(table))
+
+
+def countRows(the_map, table):
+    """
+    Number of rows of @table, computed without rendering them.
+    """
+    if table == "mineworking":
+        return 1 + (the_map.elevator is not None)
+    elif table in ["drillholes", "points"]:
+        return len(the_map.drills) * (2 if table == "points" else 1)
+    elif table == "multiline_drillholes":
+        return 1 if len(the_map.drills) > 0 else 0
+    elif table == "segments":
+        return sum(
+            len(np.arange(0, drill.length, drill.segment_size))
+            for drill in the_map.drills)
+    elif table == "geological_shapes":
+        return len(the_map.shapes)
+    elif table == "blockmodel":
+        return sum(len(shape.block_indexes) for shape in the_map.shapes)
+    raise ValueError("unknown table '{}'".format(table))
+
+
+def rowGroups(table, entities, elevator=None):
+    """
+    Group @entities into the rows of @table. Each row is a list of
+    entities; tables in MERGED_TABLES have all entities merged into a
+    single row, except for the @elevator cell which has a row of its own.
+    """
+    if not table in MERGED_TABLES:
+        return [[e] for e in entities]
+    standalone = [
+        e for e in entities
+        if elevator is not None and getattr(e, "cell", None) is elevator]
+    merged = [e for e in entities if not e in standalone]
+    groups = [merged] if len(merged) > 0 else []
+    return groups + [[e] for e in standalone]
+
+
+def render(table, group):
+    """
+    WKT representation of a row of @table made of the entities in @group.
+    """
+    if table in MERGED_TABLES:
+        return "{}({})".format(
+            MERGED_TABLES[table],
+            ",".join(e.coords() for e in group))
+    return group[0].wkt()
+
+
+def renderArray(table, group):
+    """
+    Coordinates of a row of @table made of the entities in @group, as
+    returned by Entity.array(). Merged rows stack the arrays of their
+    entities: the faces of all cells, or one (2,3) array per line.
+    """
+    if table == "mineworking":
+        return np.concatenate([e.array() for e in group])
+    elif table in MERGED_TABLES:
+        return np.stack([e.array() for e in group])
+    return group[0].array()
+
+
+def boundingBoxes(entities):
+    """
+    Return an (N,6) array with the bounding boxes of @entities.
+    """
+    if len(entities) == 0:
+        return np.empty((0, 6))
+    return np.array([e.bbox() for e in entities], dtype=np.float64)
+
+
+def groupBoundingBoxes(groups):
+    """
+    Return an (N,6) array with the bounding boxes of each row in @groups.
+    """
+    if all(len(group) == 1 for group in groups):
+        return boundingBoxes([group[0] for group in groups])
+    bboxes = np.empty((len(groups), 6))
+    for i, group in enumerate(groups):
+        b = boundingBoxes(group)
+        bboxes[i, 0:3] = b[:, 0:3].min(axis=0)
+        bboxes[i, 3:6] = b[:, 3:6].max(axis=0)
+    return bboxes
+
+
+def extent(bboxes):
+    """
+    Return the bounding box that encloses all of @bboxes.
+    """
+    if len(bboxes) == 0:
+        return np.full(6, np.nan)
+    return np.concatenate([
+        bboxes[:, 0:3].min(axis=0),
+        bboxes[:, 3:6].max(axis=0)])
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Output size estimator. Predicts the number of rows and the size of the
+# files of each table by sampling only the cheap parts of the generator
+# (object counts, shape sizes and drill hole lengths). No geometry is
+# created.
+
+from collections import OrderedDict
+from src.blockmodel import BLOCK_TEMPLATE
+from src.mine import genDistribution
+from src.network import LEVEL_SPACING, nodeId
+from src.objects import GeologicalShape
+from src.output import TABLES
+from src.tiles import Tiling
+import numpy as np
+import random
+import math
+
+# Number of random coordinates used to measure their textual length
+COORD_SAMPLES = 256
+
+# Corridor cells usually have two side walls plus a floor and a ceiling
+WALLS_PER_CELL = 4
+
+# Distinct vertices per corridor cell once the mine working is welded
+VERTICES_PER_CELL = 4
+
+# Measured on generated shapes: each block contributes about 6 hull points
+# and each hull point about 6 Delaunay triangles to the shape geometry
+HULL_POINTS_PER_BLOCK = 6.2
+TRIANGLES_PER_HULL_POINT = 6.2
+
+# Approximate size of the headers of PLY files and .npz archives
+PLY_HEADER_BYTES = 200
+NPZ_ARRAY_BYTES = 300
+
+def countBlocks(xsize, ysize, zsize, cube_size=GeologicalShape.CUBE_SIZE):
+    """
+    Number of blocks and of (i, j) block columns that a geological shape
+    of the given dimensions would have. Mirrors the draws of
+    GeologicalShape.__createGeometry() without laying out its blocks.
+    """
+    random_ysize = random.randrange(ysize)
+    random_zsize = random.randrange(zsize)
+    blocks, columns = 0, 0
+    for i in range(0, xsize, cube_size):
+        y_min = random.randrange(random_ysize + 1)
+        y_rand = random.randrange(random_ysize + 1, ysize + 1)
+        y_max = ysize if random_ysize == ysize else y_rand
+        for j in range(y_min, y_max, cube_size):
+            z_min = random.randrange(random_zsize + 1)
+            z_rand = random.randrange(random_zsize + 1, zsize + 1)
+            z_max = zsize if random_zsize == zsize else z_rand
+            num = len(range(z_min, z_max, cube_size))
+            blocks += num
+            columns += 1 if num > 0 else 0
+        if blocks >= xsize * ysize * zsize:
+            break
+    return blocks, columns
+
+def countCorridorCells(cols, rows, num_rooms, fixed):
+    """
+    Approximate number of corridor cells of a level or tile, whose
+    @fixed endpoints are its elevator and gates. Other endpoints are
+    sampled and linked as in MapGen.__createCorridors(): each one is
+    connected to its nearest endpoint that does not close a cycle, by
+    an L-shaped corridor. Overlapping corridors are counted twice.
+    """
+    endpoints = np.array(list(fixed) + [
+        (random.randint(0, cols-1), random.randint(0, rows-1))
+        for x in range(num_rooms-1)])
+    delta = endpoints[:, None, :] - endpoints[None, :, :]
+    distance = np.sqrt((delta**2).sum(axis=2))
+    component = list(range(len(endpoints)))
+    cells = 1
+    for i in range(len(endpoints)):
+        for j in np.argsort(distance[i], kind="stable").tolist():
+            if component[j] != component[i]:
+                old = component[j]
+                component = [component[i] if c == old else c for c in component]
+                cells += int(np.abs(delta[i, j]).sum())
+                break
+    return int(min(cells, cols * rows))
+
+def textLength(values):
+    """
+    Average length of @values once formatted as in Point.coords().
+    """
+    return np.mean([len("{}".format(v)) for v in values])
+
+
+class SizeEstimator:
+    """
+    Predict rows and bytes of each table, for the given output type and
+    block model and mine working formats, and for levels made of @tiles
+    = (tile_cols, tile_rows) grids if given (see tiles.Tiling). The
+    corridor network tables are estimated too if @network is set. The
+    @segment_blocks and @shape_overlaps tables and the @queries files
+    depend on where the objects end up, so they are listed as not
+    counted when requested.
+    """
+    def __init__(self, cfg, output_type="wkt", blockmodel_format="wkt",
+                 mineworking_format="wkt", segment_blocks=False,
+                 shape_overlaps=False, network=False, queries=0, tiles=None):
+        self.cols = int(cfg.get("Floor", "grid_cols"))
+        self.rows = int(cfg.get("Floor", "grid_rows"))
+        self.tiling = Tiling(tiles, self.cols, self.rows) \
+            if tiles is not None else None
+        # Size of the level, in cells, for the extent of its coordinates
+        self.level_cols = self.cols * (tiles[0] if tiles is not None else 1)
+        self.level_rows = self.rows * (tiles[1] if tiles is not None else 1)
+        self.cell_height = int(cfg.get("Floor", "cell_height"))
+        self.cell_width = int(cfg.get("Floor", "cell_width"))
+        self.min_seeds = int(cfg.get("Floor", "min_seeds"))
+        self.max_seeds = int(cfg.get("Floor", "max_seeds"))
+        self.interval_length = int(cfg.get("DrillHoles", "interval_length"))
+        self.wall_refinement = cfg.getint("Floor", "wall_refinement", fallback=0)
+        self.shape_refinement = cfg.getint(
+            "GeologicalShapes", "surface_refinement", fallback=0)
+        self.output_type = output_type
+        self.blockmodel_format = blockmodel_format
+        self.mineworking_format = mineworking_format
+        self.network = network
+        self.uncounted = [
+            name for name, requested in [
+                ("segment_blocks", segment_blocks),
+                ("shape_overlaps", shape_overlaps),
+                ("queries", queries > 0)]
+            if requested]
+
+    def pointLength(self, level, margin):
+        """
+        Average length of the textual coordinates of a point located
+        within @margin of the mine working of @level.
+        """
+        n = COORD_SAMPLES
+        xmax = self.level_cols * self.cell_width
+        ymax = self.level_rows * self.cell_width
+        z = -level * self.cell_height * 25
+        return 2 + \
+            textLength(np.random.uniform(-margin, xmax + margin, n).tolist()) + \
+            textLength(np.random.uniform(-margin, ymax + margin, n).tolist()) + \
+            textLength(np.random.uniform(z - margin, z + margin, n).tolist())
+
+    def cellPointLength(self, level, welded=False):
+        """
+        Average length of the textual coordinates of a corner of a
+        corridor cell. Heights are integers unless the mesh is welded.
+        """
+        w = self.cell_width
+        xs = [c * w + d * w/2 for c in range(self.level_cols) for d in [-1, 1]]
+        ys = [r * w + d * w/2 for r in range(self.level_rows) for d in [-1, 1]]
+        z = -level * self.cell_height * 25
+        zs = [z, z + self.cell_height]
+        if welded:
+            zs = [float(v) for v in zs]
+        return 2 + textLength(xs) + textLength(ys) + textLength(zs)
+
+    def level(self, level, num_levels, num_drills, num_shapes,
+              drill_size_gen, shape_size_gens, elevator=(0, 0)):
+        """
+        Return an OrderedDict with the estimated number of rows and bytes
+        of each table of @level. Tiled levels are the sum of their tiles,
+        each one with corridors of its own and a share of the drill holes
+        and shapes, as in MineGenerator.writeTiles().
+        """
+        if self.tiling is None:
+            return self.part(
+                level, num_levels, num_drills, num_shapes,
+                drill_size_gen, shape_size_gens, elevator, [])
+
+        drills = genDistribution(num_drills, num_drills, len(self.tiling))
+        shapes = genDistribution(num_shapes, num_shapes, len(self.tiling))
+        seed = random.getrandbits(64)
+        sizes = OrderedDict()
+        for n, tile in enumerate(self.tiling):
+            part = self.part(
+                level, num_levels, drills[n], shapes[n],
+                drill_size_gen, shape_size_gens,
+                self.tiling.local(elevator, tile),
+                self.tiling.gates(tile, seed))
+            for table, (num_rows, size) in part.items():
+                total = sizes.setdefault(table, [0, 0])
+                total[0] += num_rows
+                total[1] += size
+        return sizes
+
+    def part(self, level, num_levels, num_drills, num_shapes,
+             drill_size_gen, shape_size_gens, elevator, gates):
+        """
+        Estimates of a whole level, or of one of its tiles, holding the
+        @elevator if not None and opening onto other tiles through @gates.
+        """
+        # Mine working
+        num_rooms = random.randint(self.min_seeds, self.max_seeds)
+        fixed = ([elevator] if elevator is not None else []) + \
+            [cell for cell, outside in gates]
+        cells = countCorridorCells(self.cols, self.rows, num_rooms, fixed)
+        has_elevator = elevator is not None and \
+            level > 0 and level == num_levels-1
+
+        # Drill holes and their segments
+        lengths = np.asarray(drill_size_gen.generate(num_drills)) \
+            if num_drills > 0 else np.empty(0)
+        num_segments = int(np.ceil(
+            np.maximum(lengths, 0) / self.interval_length).sum())
+        margin = float(lengths.max()) if len(lengths) else 0.0
+        point_len = self.pointLength(level, margin)
+
+        # Geological shapes and their blocks
+        blocks, columns = 0, 0
+        for s in range(num_shapes):
+            sizes = [math.ceil(g.generate(1)[0]) for g in shape_size_gens]
+            b, c = countBlocks(*sizes)
+            blocks, columns = blocks + b, columns + c
+
+        sizes = OrderedDict()
+        sizes["mineworking"] = self.mineworkingSize(level, cells, has_elevator)
+        sizes["drillholes"] = self.rowsSize(
+            num_drills, 16 + 2 * point_len)
+        sizes["multiline_drillholes"] = self.rowsSize(
+            1 if num_drills > 0 else 0, 18 + num_drills * (6 + 2 * point_len))
+        sizes["segments"] = self.rowsSize(
+            num_segments, 16 + 2 * point_len)
+        sizes["points"] = self.rowsSize(
+            2 * num_drills, 9 + point_len)
+        triangles = blocks * HULL_POINTS_PER_BLOCK * TRIANGLES_PER_HULL_POINT * \
+            6**self.shape_refinement
+        shape_bytes = 20 * num_shapes + triangles * (8 + 4 * point_len)
+        sizes["geological_shapes"] = self.rowsSize(
+            num_shapes, shape_bytes / max(num_shapes, 1))
+        sizes["blockmodel"] = self.blockmodelSize(
+            blocks, columns, num_shapes, point_len)
+        if self.network:
+            sizes.update(self.networkSize(
+                level, cells, len(gates) + (elevator is not None and level > 0)))
+        return sizes
+
+    def rowsSize(self, num_rows, row_bytes):
+        """
+        Size of a file with @num_rows rows of @row_bytes bytes each.
+        """
+        if self.output_type == "postgis":
+            header = 250
+            return [num_rows, int(header + num_rows * (row_bytes + 6))]
+        return [num_rows, int(num_rows * (row_bytes + 1))]
+
+    def mineworkingSize(self, level, cells, has_elevator):
+        """
+        Rows and bytes of the mine working in the selected format.
+        """
+        # Each level of refinement splits every triangle in 6, and the
+        # corners of refined triangles are no longer integers
+        refinement = 6**self.wall_refinement
+        triangles = cells * WALLS_PER_CELL * 2 * refinement
+        vertices = cells * VERTICES_PER_CELL
+        if refinement > 1:
+            vertices = max(vertices, triangles // 2)
+        if self.mineworking_format in ["obj", "ply"]:
+            if has_elevator:
+                triangles, vertices = triangles + 12, vertices + 8
+            vertex_len = self.cellPointLength(level, welded=True) \
+                if refinement == 1 else self.pointLength(level, 0)
+            face_len = 3 * (len(str(vertices)) + 1)
+            size = vertices * (vertex_len + 1) + triangles * (face_len + 2)
+            if self.mineworking_format == "obj":
+                size += 2 * vertices
+            else:
+                size += PLY_HEADER_BYTES
+            return [1, int(size)]
+
+        welded = self.mineworking_format == "welded"
+        if welded and has_elevator:
+            triangles += 12
+        point_len = self.cellPointLength(level, welded) \
+            if refinement == 1 else self.pointLength(level, 0)
+        num_rows, size = self.rowsSize(1, 20 + triangles * (11 + 4 * point_len))
+        if has_elevator and not welded:
+            size += self.rowsSize(1, 20 + 12 * (11 + 4 * point_len))[1]
+            num_rows += 1
+        return [num_rows, size]
+
+    def blockmodelSize(self, blocks, columns, num_shapes, point_len):
+        """
+        Rows and bytes of the block model in the selected format.
+        """
+        if self.blockmodel_format == "npz":
+            # Uncompressed size of the arrays (see BlockModelSet.save)
+            size = 4 * NPZ_ARRAY_BYTES + num_shapes * (24 + 8 + 8) + columns * 32
+            return [blocks, size]
+        template_len = len(BLOCK_TEMPLATE.format(*[""] * 24))
+        return self.rowsSize(blocks, template_len + 30 * (point_len - 2))
+
+    def networkSize(self, level, cells, links):
+        """
+        Rows and bytes of the corridor_nodes and corridor_edges tables:
+        one node per corridor cell, and about as many edges, as the
+        corridors link their endpoints into a tree, plus the @links
+        through gates and up the elevator shaft.
+        """
+        w = self.cell_width
+        node_len = len(str(nodeId(
+            level, self.level_cols - 1, self.level_rows - 1)))
+        distance = float(level * self.cell_height * LEVEL_SPACING + \
+            (self.level_cols + self.level_rows) * w / 2)
+        point_len = self.cellPointLength(level)
+        num_edges = cells + links
+        sizes = OrderedDict()
+        sizes["corridor_nodes"] = self.rowsSize(
+            cells, 14 + node_len + len(str(distance)) + point_len)
+        sizes["corridor_edges"] = self.rowsSize(
+            num_edges, 21 + 2 * node_len + len(str(float(w))) + 2 * point_len)
+        return sizes
+
+    def report(self, levels):
+        """
+        Print the per-level and total estimates returned by level().
+        """
+        totals = OrderedDict((table, [0, 0]) for table in TABLES)
+        fmt = "{:>5}  {:<22} {:>14} {:>12}"
+        print(fmt.format("Level", "Table", "Rows", "Bytes"))
+        for level, sizes in enumerate(levels):
+            for table, (num_rows, size) in sizes.items():
+                print(fmt.format(level, table, num_rows, humanBytes(size)))
+                totals.setdefault(table, [0, 0])
+                totals[table][0] += num_rows
+                totals[table][1] += size
+        for table, (num_rows, size) in totals.items():
+            print(fmt.format("total", table, num_rows, humanBytes(size)))
+        print("Estimated rows: {}, estimated size: {}".format(
+            sum(t[0] for t in totals.values()),
+            humanBytes(sum(t[1] for t in totals.values()))))
+        if len(self.uncounted) > 0:
+            print("Not counted: {}".format(", ".join(self.uncounted)))
+
+
+def humanBytes(size):
+    """
+    Format a number of bytes using binary prefixes.
+    """
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if size < 1024 or unit == "TiB":
+            return "{:.1f} {}".format(size, unit) if unit != "B" \
+                else "{} B".format(int(size))
+        size /= 1024.0
@@ -230,27 +230,25 @@ class Tetrahedron:
 
 
 class Hexahedron:
-    def __init__(self, pcenter, xsize, ysize, zsize):
-        self.points = [Point(pcenter.x, pcenter.y, pcenter.z) for x in range(8)]
-
-        self.points[1].x += xsize
-
-        self.points[2].x += xsize
-        self.points[2].z += zsize
-
-        self.points[3].z += zsize
-
-        self.points[4].y += ysize
-
-        self.points[5].y += ysize
-        self.points[5].z += zsize
+    # Corners of the unit cube, as multiples of (xsize, ysize, zsize)
+    CORNERS = [
+        [0, 0, 0],
+        [1, 0, 0],
+        [1, 0, 1],
+        [0, 0, 1],
+        [0, 1, 0],
+        [0, 1, 1],
+        [1, 1, 1],
+        [1, 1, 0]
+    ]
 
-        self.points[6].x += xsize
-        self.points[6].y += ysize
-        self.points[6].z += zsize
-
-        self.points[7].x += xsize
-        self.points[7].y += ysize
+    def __init__(self, pcenter, xsize, ysize, zsize):
+        self.points = [
+            Point(
+                pcenter.x + dx * xsize,
+                pcenter.y + dy * ysize,
+                pcenter.z + dz * zsize)
+            for dx, dy, dz in self.CORNERS]
 
         # Orientation
         self.order = [
@@ -4,9 +4,13 @@
 # Floor creator. Orchestrates the creation of drillholes, blockmodels
 # and geological shapes.
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from src.geometry import *
 from src.objects import *
+from src.mesh import WallMesh
+from src.voxels import ClearanceGrid
+from src.overlaps import rejectOverlaps
+from src.spill import CELL_BYTES
 import concurrent.futures
 import numpy as np
 import random
@@ -69,6 +73,13 @@ class Graph:
 
 
 class MapGen:
+    # Generation stages, in order, along with the attributes they set
+    STAGES = OrderedDict([
+        ("corridors", ["map", "corridor", "elevator", "num_rooms", "refine_seed"]),
+        ("drillholes", ["drills"]),
+        ("shapes", ["shapes"])
+    ])
+
     def __init__(self, size_generator, shape_size_generators, 
                  cols=100,
                  rows=45, min_seeds=10, max_seeds=20,
@@ -76,10 +87,27 @@ class MapGen:
                  num_drills=100,
                  cell_height=3, cell_width=4,
                  drill_ival_length=10,
-                 num_shapes=3):
+                 drill_clearance=0,
+                 clearance_attempts=10,
+                 num_shapes=3,
+                 shape_bank=None,
+                 bank_reuse=1.0,
+                 spill=None,
+                 gates=(),
+                 origin=(0, 0),
+                 shaft_top=0,
+                 wall_refinement=0,
+                 rough_walls=False,
+                 shape_refinement=0,
+                 rough_shapes=False,
+                 reject_overlaps=False):
         self.cols = cols
         self.rows = rows
         self.drill_interval_length = drill_ival_length
+        # Minimum distance between drill holes (0 to disable) and how many
+        # times a drill hole is placed again before giving up on it
+        self.drill_clearance = drill_clearance
+        self.clearance_attempts = clearance_attempts
         self.map = np.empty((cols, rows), dtype=object)
         self.num_rooms = random.randint(min_seeds, max_seeds)
         self.elevator_coords = elevator_coords
@@ -89,11 +117,37 @@ class MapGen:
         self.cell_width = cell_width
         self.size_generator = size_generator
         self.shape_size_generators = shape_size_generators
+        # Fraction of the shapes taken from @shape_bank, if given, rather
+        # than grown from scratch (see shapebank.ShapeBank)
+        self.shape_bank = shape_bank
+        self.bank_reuse = bank_reuse
+        # Memory budget of the level (see spill.SpillArea), if any
+        self.spill = spill
+        # Tiles of a larger level (see tiles.Tiling) hold no elevator
+        # unless it lies within them, open onto their neighbors through
+        # @gates and are placed at cell @origin of the level
+        self.gates = list(gates)
+        self.origin = origin
+        # Level where the elevator shaft starts. Levels appended to a mine
+        # extend the shaft of its former last level rather than repeat it.
+        self.shaft_top = shaft_top
+        # How many times the triangles of the corridor walls and of the
+        # shape surfaces are subdivided, and whether they become rough
+        # (see mesh.subdivide())
+        self.wall_refinement = wall_refinement
+        self.rough_walls = rough_walls
+        self.shape_refinement = shape_refinement
+        self.rough_shapes = rough_shapes
+        self.refine_seed = None
+        # Whether shapes that overlap the ones created before them are
+        # dropped (see overlaps.rejectOverlaps())
+        self.reject_overlaps = reject_overlaps
         # The following are variables we want to share with the caller
         self.corridor = []
         self.drills = []
         self.shapes = []
         self.elevator = None
+        self.wall_mesh = None
 
     def __str__(self):
         drill_locations = {}
@@ -132,26 +186,95 @@ class MapGen:
         corridors. Lastly, geological shapes and block models are
         generated.
         @level determines how deep underground this level is found.
+        The elevator is created on the last of @num_levels levels; pass
+        None if the number of levels is not known yet and call
+        createElevator() once it is.
         """
         print("Processing level {}".format(level))
-        self.__createCorridors(level)
-        if level > 0 and level == num_levels-1:
-            self.__createElevator(num_levels)
-        self.__createDrillholes()
+        for stage in self.STAGES:
+            self.createStage(stage, level, num_levels)
+
+    def createStage(self, stage, level, num_levels):
+        """
+        Run a single stage of create(). Each stage builds upon the
+        outcome of the previous ones, in the order of STAGES.
+        """
+        if stage == "corridors":
+            self.__createCorridors(level)
+            if num_levels is not None and level > 0 and level == num_levels-1 \
+                and self.elevator_coords is not None:
+                self.createElevator(num_levels)
+            if self.spill is not None:
+                self.spill.track(stage, len(self.corridor) * CELL_BYTES)
+        elif stage == "drillholes":
+            self.__createDrillholes()
+        elif stage == "shapes":
+            self.__createGeologicalShapes()
+        else:
+            raise ValueError("unknown stage '{}'".format(stage))
 
+    def stageState(self, stage):
+        """
+        Return the objects created by @stage, so that they can be
+        persisted and handed back to restoreStage() later on.
+        """
+        return {attr: getattr(self, attr) for attr in self.STAGES[stage]}
+
+    def restoreStage(self, stage, state):
+        """
+        Restore the objects created by @stage from a previous run
+        instead of creating them again.
+        """
+        for attr in self.STAGES[stage]:
+            setattr(self, attr, state[attr])
+        if stage == "corridors":
+            self.wall_mesh = None
+        elif stage == "drillholes":
+            for drill in self.drills:
+                drill.segment_size = self.drill_interval_length
+            if self.spill is not None:
+                self.drills = self.spill.drills(self.drills)
+                self.drills.flush()
+        elif stage == "shapes" and self.spill is not None:
+            self.shapes = [self.spill.shape(shape) for shape in self.shapes]
+
+    def __createGeologicalShapes(self):
         # Pick the endpoint of some random drillholes as seeds for the
-        # starting point of the geological shapes.
-        seeds = [d.line.p2 for d in random.sample(self.drills, self.num_shapes)]
+        # starting point of the geological shapes. Levels with fewer drill
+        # holes than shapes get one shape per drill hole.
+        num_shapes = min(self.num_shapes, len(self.drills))
+        seeds = [d.line.p2 for d in random.sample(self.drills, num_shapes)]
+
+        # Shape sizes and the random generator of each shape are drawn
+        # upfront, so that the shapes do not depend on thread scheduling.
+        sizes = [
+            [math.ceil(gen.generate(1)[0]) for gen in self.shape_size_generators]
+            for seed in seeds]
+        rngs = [random.Random(random.getrandbits(64)) for seed in seeds]
+        banked = [False] * len(seeds)
+        if self.shape_bank is not None:
+            banked = [random.random() < self.bank_reuse for seed in seeds]
 
         # Launch parallel instances of the geological shape creator. Note
         # that because shapes can be very large, it is possible to exceed
         # the amount of space reserved for IPC shared memory. Our workaround
         # is to use a thread pool (at the expense of having to be ruled by
         # Python's Global Interpreter Lock).
+        self.shapes = []
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            for shape in executor.map(self.__createGeologicalShape, seeds):
+            for shape in executor.map(
+                    self.__createGeologicalShape, seeds, sizes, rngs, banked):
                 self.shapes.append(shape)
 
+        if self.reject_overlaps:
+            kept = rejectOverlaps(self.shapes)
+            if len(kept) < len(self.shapes):
+                print("Level keeps {} of {} geological shapes without overlaps".format(
+                    len(kept), len(self.shapes)))
+            self.shapes = [self.shapes[n] for n in kept]
+            if self.spill is not None:
+                self.shapes = [self.spill.shape(shape) for shape in self.shapes]
+
     def __createCorridors(self, level):
         # Initialize the map
         for row in range(self.rows):
@@ -159,7 +282,9 @@ class MapGen:
                 self.map[col,row] = None
 
         # Create the endpoints
-        endpoints = [self.elevator_coords] + [
+        endpoints = [self.elevator_coords] if self.elevator_coords is not None else []
+        endpoints += [cell for cell, outside in self.gates]
+        endpoints += [
             (random.randint(0, self.cols-1), random.randint(0, self.rows-1))
             for x in range(self.num_rooms-1)]
         for col, row in endpoints:
@@ -199,50 +324,144 @@ class MapGen:
                         if self.map[ncol, nrow] != None:
                             neighbors.append((ncol, nrow))
                     cell.setNeighbors(neighbors)
+        for (col, row), outside in self.gates:
+            self.map[col, row].setNeighbors([outside])
+
+        # Move the cells of a tile to their place in the level
+        if self.origin != (0, 0):
+            offset = self.offset()
+            for cell in self.corridor:
+                cell.translate(offset)
+
+        # Walls are refined when their mesh is first needed, whether or
+        # not they were when the corridors were created
+        self.refine_seed = random.getrandbits(32)
 
-    def __createElevator(self, num_levels):
+    def createElevator(self, num_levels):
+        """
+        Create the elevator shaft that connects this level with the
+        @num_levels levels of the mine, from level @self.shaft_top down.
+        """
         col, row = self.elevator_coords
         padding = -25
         self.elevator = MineWorkingCell(
             col, row,
-            self.cell_height * (num_levels-1) * padding,
+            self.cell_height * (num_levels-1-self.shaft_top) * padding,
             self.cell_width,
             level=0,
             padding=1,
             cell_type=MineWorkingCell.CORRIDOR)
+        if self.shaft_top > 0:
+            self.elevator.translate(
+                Point(0, 0, self.cell_height * self.shaft_top * padding))
+        if self.origin != (0, 0):
+            self.elevator.translate(self.offset())
+
+    def offset(self):
+        """
+        Translation of the cells of this grid to their place in the level.
+        """
+        col, row = self.origin
+        return Point(col * self.cell_width, row * self.cell_width, 0)
 
     def __createDrillholes(self):
         # Distribute drill holes on corridor cells, populating the
-        # @self.drills list as it iterates the corridor cells.
-        drill_distribution = [
-            random.randint(0, len(self.corridor)-1)
-            for x in range(self.num_drills)]
-
-        for corridor_idx in drill_distribution:
-            cell = self.corridor[corridor_idx]
-            for i in range(drill_distribution.count(corridor_idx)):
-                pcenter, normal = cell.randomPointOnTheWall()
-                if pcenter is not None:
-                    drillhole = DrillHole(
-                        pcenter,
-                        normal,
-                        cell.col,
-                        cell.row,
-                        self.size_generator,
-                        self.drill_interval_length)
-                    drillhole.create()
-                    self.drills.append(drillhole)
-
-    def __createGeologicalShape(self, seed):
-        xsize = math.ceil(self.shape_size_generators[0].generate(1)[0])
-        ysize = math.ceil(self.shape_size_generators[1].generate(1)[0])
-        zsize = math.ceil(self.shape_size_generators[2].generate(1)[0])
-
-        max_blocks = xsize * ysize * zsize
-        shape = GeologicalShape(xsize, ysize, zsize, max_blocks)
-        shape.create(seed)
+        # @self.drills list. Collars are sampled all at once from the
+        # walls of the corridor mesh.
+        drill_distribution = np.random.randint(
+            0, len(self.corridor), size=self.num_drills)
+        points, normals, valid = \
+            self.wallMesh().randomPointsOnTheWalls(drill_distribution)
+        if self.spill is not None:
+            self.drills = self.spill.drills(self.drills)
+
+        grid = None
+        if self.drill_clearance > 0:
+            grid = ClearanceGrid(self.drill_clearance)
+        # Drill holes dropped as no clear placement was found for them
+        rejected = 0
+        for corridor_idx, pcenter, normal in zip(
+                drill_distribution[valid].tolist(),
+                points[valid].tolist(),
+                normals[valid].tolist()):
+            drillhole = self.__createDrillhole(corridor_idx, pcenter, normal)
+            if self.drill_clearance > 0:
+                drillhole = self.__clearDrillhole(drillhole, grid)
+            if drillhole is not None:
+                self.drills.append(drillhole)
+            else:
+                rejected += 1
+        if self.spill is not None:
+            self.drills.flush()
+        if rejected > 0:
+            print("Level drops {} of {} drill holes to keep a clearance of {}".format(
+                rejected, len(self.drills) + rejected, self.drill_clearance))
+
+    def __createDrillhole(self, corridor_idx, pcenter, normal):
+        cell = self.corridor[corridor_idx]
+        drillhole = DrillHole(
+            Point(*pcenter),
+            Point(*normal),
+            cell.col,
+            cell.row,
+            self.size_generator,
+            self.drill_interval_length)
+        drillhole.create()
+        return drillhole
+
+    def __clearDrillhole(self, drillhole, grid):
+        """
+        Make sure that @drillhole keeps the clearance from the drill holes
+        added to @grid so far, by placing it again at a random point of
+        the walls if needed. Returns None if no clear placement is found.
+        """
+        for attempt in range(self.clearance_attempts + 1):
+            p1, p2 = drillhole.line.p1, drillhole.line.p2
+            ends = ([p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z])
+            if grid.isClear(*ends):
+                grid.add(*ends)
+                return drillhole
+            if attempt == self.clearance_attempts:
+                break
+            corridor_idx = np.random.randint(0, len(self.corridor), size=1)
+            points, normals, valid = \
+                self.wallMesh().randomPointsOnTheWalls(corridor_idx)
+            if valid[0]:
+                drillhole = self.__createDrillhole(
+                    int(corridor_idx[0]), points[0].tolist(), normals[0].tolist())
+        return None
+
+    def __createGeologicalShape(self, seed, sizes, rng, banked=False):
+        if banked:
+            shape = self.shape_bank.place(seed, rng)
+        else:
+            xsize, ysize, zsize = sizes
+            max_blocks = xsize * ysize * zsize
+            shape = GeologicalShape(xsize, ysize, zsize, max_blocks, rng)
+            shape.create(seed)
+        if self.shape_refinement > 0:
+            shape.refine(
+                self.shape_refinement, not self.rough_shapes,
+                np.random.RandomState(rng.getrandbits(32)))
+        # Shapes are spilled as soon as they are done, rather than once
+        # all of them are, unless some of them may be dropped yet
+        if self.spill is not None and not self.reject_overlaps:
+            shape = self.spill.shape(shape)
         return shape
 
+    def wallMesh(self):
+        """
+        Return the WallMesh of the corridor cells. It is computed once,
+        after the corridors have been created.
+        """
+        if self.wall_mesh is None:
+            self.wall_mesh = WallMesh.fromMap(self)
+            if self.wall_refinement > 0:
+                self.wall_mesh.refine(
+                    self.wall_refinement, not self.rough_walls,
+                    np.random.RandomState(self.refine_seed))
+        return self.wall_mesh
+
     def nearestNeighbor(self, coords, my_index, blacklist):
         """
         Compute the euclidean distance of coords[my_index] and all other
@@ -276,7 +495,8 @@ class MapGen:
         """
         Connect two given cells by creating a corridor between
         them. The resulting cells are appended to @self.corridor
-        and the grid at @self.map is updated accordingly.
+        (unless they already belong to another corridor) and the
+        grid at @self.map is updated accordingly.
         """
         h, w = self.cell_height, self.cell_width
         from_col, from_row = from_coords
@@ -288,8 +508,9 @@ class MapGen:
             if cell == None:
                 cell = self.map[col, from_row] = MineWorkingCell(
                     col, from_row, self.cell_height, self.cell_width, level)
-            cell.type = value
-            self.corridor.append(cell)
+            if cell.type != value:
+                cell.type = value
+                self.corridor.append(cell)
 
         direction = 1 if to_row > from_row else -1
         for row in range(from_row, to_row+(1*direction), direction):
@@ -297,5 +518,6 @@ class MapGen:
             if cell == None:
                 cell = self.map[to_col, row] = MineWorkingCell(
                     to_col, row, self.cell_height, self.cell_width, level)
-            cell.type = value
-            self.corridor.append(cell)
+            if cell.type != value:
+                cell.type = value
+                self.corridor.append(cell)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Triangle meshes of the mine working. Walls of all corridor cells are
+# computed at once from the occupancy grid of the level, and can be
+# welded into an indexed mesh in which vertices shared by several
+# triangles are stored only once. Meshes can be refined into many more
+# (and optionally rougher) triangles, see subdivide().
+
+from collections import OrderedDict
+import numpy as np
+
+# Largest displacement of the pivots of rough subdivisions
+ROUGHNESS = 0.25
+
+def subdivide(triangles, levels=1, preserve_shape=True, rng=np.random):
+    """
+    Subdivide each of the (T,3,3) @triangles @levels times, as
+    Triangle.subdivide() does: a random pivot on the triangle and the
+    midpoints of its edges make up 6 smaller triangles. If
+    @preserve_shape is not set, pivots are moved along the normal of
+    their triangle by up to ROUGHNESS, for rough looking surfaces.
+    Returns a (T*6**levels,3,3) array in which the triangles that come
+    from the same one are contiguous. Random numbers are drawn from
+    @rng, a numpy.random.RandomState.
+    """
+    triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+    for level in range(levels):
+        p1, p2, p3 = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+        num = len(triangles)
+
+        # Random point on each triangle
+        a = np.sqrt(rng.uniform(0, 1, num))[:, None]
+        b = rng.uniform(0, 1, num)[:, None]
+        pivot = (1.0 - a) * p1 + (a * (1.0 - b)) * p2 + (a * b) * p3
+        if not preserve_shape:
+            normal = np.cross(p2 - p1, p3 - p1)
+            length = np.sqrt((normal * normal).sum(axis=1))[:, None]
+            length[length == 0.0] = 1.0
+            pivot += normal / length * rng.uniform(0.0, ROUGHNESS, num)[:, None]
+
+        m12 = p1 + (p2 - p1) / 2
+        m23 = p2 + (p3 - p2) / 2
+        m13 = p1 + (p3 - p1) / 2
+        triangles = np.stack([
+            np.stack([p1, m12, pivot], axis=1),
+            np.stack([m12, p2, pivot], axis=1),
+            np.stack([p2, m23, pivot], axis=1),
+            np.stack([m23, p3, pivot], axis=1),
+            np.stack([p3, m13, pivot], axis=1),
+            np.stack([m13, p1, pivot], axis=1)], axis=1).reshape(-1, 3, 3)
+    return triangles
+
+
+class WallMesh:
+    """
+    Exposed walls of a list of mineworking cells. Each cell has 8 corners:
+    the 4 points of its floor followed by the 4 points of its ceiling
+    (see MineWorkingCell.points and MineWorkingCell.points_ceiling).
+    """
+    # Triangles of each wall, given as indexes into the cell corners.
+    # Same orientations, order and winding as MineWorkingCell.getWall().
+    WALLS = OrderedDict([
+        ('n', [[2, 0, 4], [4, 6, 2]]),
+        ('s', [[1, 3, 7], [7, 5, 1]]),
+        ('w', [[0, 1, 5], [5, 4, 0]]),
+        ('e', [[3, 2, 6], [6, 7, 3]]),
+        ('u', [[4, 6, 5], [5, 6, 7]]),
+        ('d', [[0, 2, 1], [1, 2, 3]])
+    ])
+
+    # Walls that face sideways and may host a drill hole collar
+    SIDE_WALLS = ['n', 's', 'w', 'e']
+
+    def __init__(self, cells, walls):
+        """
+        @walls is a (C,6) boolean array telling which walls of each of
+        the C @cells exist, following the order of WALLS.
+        """
+        self.cells = cells
+        self.walls = walls
+
+        pcenters = np.array(
+            [[c.pcenter.x, c.pcenter.y, c.pcenter.z] for c in cells]).reshape(-1, 3)
+        widths = np.array([c.width for c in cells])
+        heights = np.array([c.height for c in cells])
+
+        # x and y are kept apart from z so that integer heights are
+        # preserved (and formatted) as such, just like in MineWorkingCell
+        offsets = np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]])
+        floor = pcenters[:, None, 0:2] + offsets[None, :, :] * (widths/2)[:, None, None]
+        self.xy = np.concatenate([floor, floor], axis=1)
+        self.z = np.repeat(
+            np.stack([pcenters[:, 2], pcenters[:, 2] + heights], axis=1), 4, axis=1)
+
+        # Corner indexes of each triangle, in the order of
+        # MineWorkingCell.coords()
+        table = np.array(list(self.WALLS.values()))
+        cell_idx, wall_idx = np.nonzero(walls)
+        self.triangle_cells = np.repeat(cell_idx, 2)
+        self.triangle_corners = \
+            table[wall_idx].reshape(-1, 3) + self.triangle_cells[:, None] * 8
+        # Triangles of the walls once refined, if they are (see refine())
+        self.refined = None
+
+    @classmethod
+    def fromMap(cls, the_map):
+        """
+        Compute the walls of all corridor cells of @the_map. A cell has a
+        wall wherever its neighbor on the grid is empty (or outside of it,
+        gates aside), plus a floor and a ceiling.
+        """
+        cells = the_map.corridor
+        occupied = np.zeros((the_map.cols+2, the_map.rows+2), dtype=bool)
+        occupied[1:-1, 1:-1] = np.vectorize(
+            lambda cell: cell is not None, otypes=[bool])(the_map.map)
+        # Gates open onto the cells of the neighboring tiles
+        for cell, (col, row) in the_map.gates:
+            occupied[col+1, row+1] = True
+        cols = np.array([c.col for c in cells], dtype=np.int64) + 1
+        rows = np.array([c.row for c in cells], dtype=np.int64) + 1
+        walls = np.ones((len(cells), len(cls.WALLS)), dtype=bool)
+        walls[:, 0] = ~occupied[cols, rows-1]
+        walls[:, 1] = ~occupied[cols, rows+1]
+        walls[:, 2] = ~occupied[cols-1, rows]
+        walls[:, 3] = ~occupied[cols+1, rows]
+        return cls(cells, walls)
+
+    def corners(self):
+        """
+        Return a (C*8,3) array with the corners of all cells.
+        """
+        return np.concatenate(
+            [self.xy.reshape(-1, 2), self.z.reshape(-1, 1)], axis=1)
+
+    def triangles(self):
+        """
+        Return a (T,3,3) array with the vertices of all wall triangles.
+        """
+        if self.refined is not None:
+            return self.refined
+        return self.corners()[self.triangle_corners]
+
+    def refine(self, levels, preserve_shape=True, rng=np.random):
+        """
+        Replace the triangles of the walls with those of their subdivision
+        (see subdivide()). The walls of each cell stay together.
+        """
+        if levels > 0:
+            triangles = self.triangles()
+            self.triangle_cells = np.repeat(self.triangle_cells, 6**levels)
+            self.refined = subdivide(triangles, levels, preserve_shape, rng)
+
+    def cellTriangles(self):
+        """
+        List with a (T,3,3) array with the wall triangles of each cell.
+        """
+        ends = np.cumsum(np.bincount(self.triangle_cells, minlength=len(self.cells)))
+        return np.split(self.triangles(), ends[:-1])
+
+    def cellCoords(self):
+        """
+        List with the textual coordinates of the walls of each cell,
+        matching MineWorkingCell.coords().
+        """
+        if self.refined is not None:
+            coords = [[] for cell in self.cells]
+            for cell, triangle in zip(self.triangle_cells.tolist(),
+                                      self.refined.tolist()):
+                a, b, c = ["{} {} {}".format(*p) for p in triangle]
+                coords[cell].append("(({0}, {1}, {2}, {0}))".format(a, b, c))
+            return [",".join(c) for c in coords]
+
+        corners = [
+            "{} {} {}".format(x, y, z)
+            for (x, y), z in zip(self.xy.reshape(-1, 2).tolist(),
+                                 self.z.reshape(-1).tolist())]
+        coords = [[] for cell in self.cells]
+        for cell, (a, b, c) in zip(self.triangle_cells.tolist(),
+                                   self.triangle_corners.tolist()):
+            coords[cell].append("(({0}, {1}, {2}, {0}))".format(
+                corners[a], corners[b], corners[c]))
+        return [",".join(c) for c in coords]
+
+    def randomPointsOnTheWalls(self, cell_indexes):
+        """
+        Pick a random point on a random side wall of each of the given
+        cells, as MineWorkingCell.randomPointOnTheWall() does. Returns
+        (D,3) arrays with the points and the surface normals, along
+        with a mask of the cells that have at least one side wall.
+        """
+        cell_indexes = np.asarray(cell_indexes, dtype=np.int64)
+        num = len(cell_indexes)
+        sides = self.walls[cell_indexes, 0:len(self.SIDE_WALLS)]
+        valid = sides.any(axis=1)
+
+        # Choose a wall among the existing ones, then one of its triangles
+        weights = np.random.random_sample(sides.shape) * sides
+        wall = np.argmax(weights, axis=1)
+        triangle = np.array(list(self.WALLS.values()))[
+            wall, np.random.randint(0, 2, size=num)]
+        corners = self.corners().reshape(-1, 8, 3)[cell_indexes]
+        p1, p2, p3 = [
+            corners[np.arange(num), triangle[:, n]] for n in range(3)]
+
+        a = np.sqrt(np.random.random_sample(num))[:, None]
+        b = np.random.random_sample(num)[:, None]
+        points = (1.0 - a) * p1 + (a * (1.0 - b)) * p2 + (a * b) * p3
+        normals = np.cross(p2 - p1, p3 - p1)
+        return points, normals, valid
+
+
+class IndexedMesh:
+    """
+    Triangle mesh made of a shared vertex buffer and face indexes.
+    """
+    def __init__(self, vertices, faces):
+        self.vertices = vertices
+        self.faces = faces
+
+    @classmethod
+    def fromTriangles(cls, triangles):
+        """
+        Build a welded mesh out of a (T,3,3) array of triangles.
+        """
+        vertices, faces = np.unique(
+            triangles.reshape(-1, 3), axis=0, return_inverse=True)
+        return cls(vertices, faces.reshape(-1, 3))
+
+    @classmethod
+    def fromMap(cls, the_map):
+        """
+        Build the mesh of the mine working of @the_map, elevator included.
+        """
+        triangles = [the_map.wallMesh().triangles()]
+        if the_map.elevator is not None:
+            elevator = the_map.elevator
+            walls = np.ones((1, len(WallMesh.WALLS)), dtype=bool)
+            triangles.append(WallMesh([elevator], walls).triangles())
+        return cls.fromTriangles(np.concatenate(triangles))
+
+    def bbox(self):
+        """
+        Return the bounding box of the mesh as a tuple
+        (xmin, ymin, zmin, xmax, ymax, zmax).
+        """
+        return tuple(self.vertices.min(axis=0)) + tuple(self.vertices.max(axis=0))
+
+    def vertexCoords(self):
+        """
+        Textual coordinates of each vertex, as in Point.coords().
+        """
+        return ["{} {} {}".format(*v) for v in self.vertices.tolist()]
+
+    def wkt(self):
+        """
+        WKT representation of the mesh as a single POLYHEDRALSURFACEZ.
+        """
+        coords = self.vertexCoords()
+        faces = [
+            "(({0}, {1}, {2}, {0}))".format(coords[a], coords[b], coords[c])
+            for a, b, c in self.faces.tolist()]
+        return "POLYHEDRALSURFACEZ({})".format(",".join(faces))
+
+    def writeObj(self, f):
+        """
+        Write the mesh to @f in Wavefront OBJ format.
+        """
+        for coords in self.vertexCoords():
+            f.write("v {}\n".format(coords))
+        for a, b, c in self.faces.tolist():
+            f.write("f {} {} {}\n".format(a+1, b+1, c+1))
+
+    def writePly(self, f):
+        """
+        Write the mesh to @f in ASCII PLY format.
+        """
+        f.write("ply\n")
+        f.write("format ascii 1.0\n")
+        f.write("element vertex {}\n".format(len(self.vertices)))
+        f.write("property double x\n")
+        f.write("property double y\n")
+        f.write("property double z\n")
+        f.write("element face {}\n".format(len(self.faces)))
+        f.write("property list uchar int vertex_indices\n")
+        f.write("end_header\n")
+        for coords in self.vertexCoords():
+            f.write("{}\n".format(coords))
+        for a, b, c in self.faces.tolist():
+            f.write("3 {} {} {}\n".format(a, b, c))
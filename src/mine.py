@@ -0,0 +1,912 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Mine generator. Draws the layout of a mine (number of levels, drill holes
+# and shapes per level, elevator position) from the settings of a config
+# file, then creates and exports each of its levels. The size distributions
+# are built once and can be shared by many mines.
+
+from collections import OrderedDict
+from src.map import MapGen
+from src.network import CorridorNetwork
+from src.output import TABLES, levelFiles, tableFiles
+from src.cache import codeVersion, configDigest, fileDigest
+from src.shapebank import ShapeBank
+from src.records import levelRecords
+from src.workload import writeQueries
+from src.spill import SpillArea
+from src.tiles import Tiling
+import src.randomvariategen as rvg
+import concurrent.futures
+import hashlib
+import json
+import numpy as np
+import random
+import pickle
+import shutil
+import glob
+import zlib
+import time
+import os
+
+# File types removed from an output directory before writing a new mine
+OUTPUT_EXTENSIONS = ["sql", "wkt", "npz", "obj", "ply", "json"]
+
+# Config sections that determine the contents of a level
+CACHED_SECTIONS = ["Floor", "DrillHoles", "GeologicalShapes"]
+
+# Directory of the output dir where incremental runs keep level state
+STATE_DIR = ".state"
+
+# Where the shape bank is kept unless GeologicalShapes.bank_file is set
+DEFAULT_BANK_FILE = "shape_bank.npz"
+
+# File of the output dir that describes the mine it holds (see append())
+METADATA_FILE = "mine.json"
+
+# Directory of the output dir where objects over the memory budget go
+SPILL_DIR = ".spill"
+
+# Tables written for the drill holes appended to an existing level
+APPENDED_TABLES = ["drillholes", "multiline_drillholes", "segments", "points"]
+
+# Generation stage (see MapGen.STAGES) that each table depends on. The
+# mine working also depends on the refinement of the walls, and the
+# segments on the drill hole interval length.
+TABLE_STAGES = {
+    "mineworking": "walls",
+    "drillholes": "drillholes",
+    "multiline_drillholes": "drillholes",
+    "segments": "segments",
+    "points": "drillholes",
+    "geological_shapes": "shapes",
+    "blockmodel": "shapes"
+}
+
+def genDistribution(min_val, max_val, num_floors):
+    num_objects = int(random.uniform(min_val, max_val))
+    excess = num_floors - num_objects
+    if excess > 0:
+        num_objects += excess
+    buckets = sorted(random.sample(range(1, num_objects), num_floors-1))
+    output = [a-b for a, b in zip(buckets+[num_objects], [0]+buckets)]
+    if excess > 0:
+        num_objects -= excess
+        while excess > 0:
+            for i,count in enumerate(output):
+                if count > 0 and excess > 0:
+                    output[i] -= 1
+                    excess -= 1
+    return output
+
+def read_file(path):
+    data = []
+    with open(path, 'r') as f:
+        data = [float(v[:-1]) for v in f.readlines()]
+    return data
+
+def seedAll(seed):
+    """
+    Seed both Python's and NumPy's random number generators. NumPy's
+    is used by the size distributions and by the drill hole placement.
+    """
+    random.seed(seed)
+    np.random.seed(seed % (1 << 32))
+
+def deriveSeed(seed, *path):
+    """
+    Seed of the part of the mine generated from @seed that is identified
+    by @path, e.g., (level, stage). Path elements are integers or strings.
+    """
+    key = tuple(
+        zlib.crc32(p.encode()) if isinstance(p, str) else p for p in path)
+    sequence = np.random.SeedSequence(seed, spawn_key=key)
+    return int(sequence.generate_state(1, dtype=np.uint64)[0])
+
+def deriveSeeds(seed, count):
+    """
+    Derive @count independent seeds from @seed.
+    """
+    children = np.random.SeedSequence(seed).spawn(count)
+    return [int(c.generate_state(1, dtype=np.uint64)[0]) for c in children]
+
+def prepareOutputDir(output_dir):
+    """
+    Create @output_dir, or remove the files of a previous run from it.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        return
+    for ext in OUTPUT_EXTENSIONS:
+        for fname in glob.glob("{}/*.{}".format(output_dir, ext)):
+            os.unlink(fname)
+
+def readMetadata(output_dir):
+    """
+    Read the metadata file of the mine written to @output_dir.
+    """
+    path = os.path.join(output_dir, METADATA_FILE)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise ValueError("no mine metadata found at '{}'".format(path))
+
+def writeMetadata(output_dir, meta):
+    """
+    Write the metadata file of the mine written to @output_dir.
+    """
+    path = os.path.join(output_dir, METADATA_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def removeLevels(output_dir, first_level):
+    """
+    Remove the files and the saved state of all levels from @first_level
+    onwards, left behind by a previous run with more levels.
+    """
+    level = first_level
+    while True:
+        state_path = os.path.join(
+            output_dir, STATE_DIR, "level_{:02d}.pkl".format(level))
+        files = levelFiles(level, output_dir)
+        if os.path.exists(state_path):
+            files.append(state_path)
+        if len(files) == 0:
+            break
+        for fname in files:
+            os.unlink(fname)
+        level += 1
+
+
+class MineGenerator:
+    """
+    Create mines following the settings in @cfg and write them with
+    @exporter (see output.Exporter). Levels are looked up in @cache
+    (see cache.LevelCache), if given, before being generated. In
+    @incremental mode, levels already in the output directory are
+    updated rather than generated again (see updateLevel()). Each level
+    comes with @queries queries of each type, if given (see workload).
+    Drill holes and shapes beyond @max_memory bytes per level, if given,
+    are spilled to disk (see spill.SpillArea). Levels are made of @tiles
+    = (tile_cols, tile_rows) grids, if given, generated by a pool of
+    @jobs worker processes (see writeTiles()).
+    """
+    def __init__(self, cfg, exporter=None, cache=None, incremental=False,
+                 queries=0, max_memory=None, tiles=None, jobs=None):
+        self.cfg = cfg
+        self.exporter = exporter
+        self.cache = cache
+        self.incremental = incremental
+        self.queries = queries
+        self.max_memory = max_memory
+        self.spill = None
+        self.tiles = tiles
+        self.jobs = jobs
+        self.version = codeVersion()
+        # Level where the elevator shaft starts (see append())
+        self.shaft_top = 0
+
+        # Obtain probabilities distributions for geological shapes in
+        # dimensions x, y, and z
+        self.geo_size_gens = []
+        for axis in ["x", "y", "z"]:
+            dist_name = cfg.get("GeologicalShapes", "{}_size_pname".format(axis))
+            dist_params = cfg.get("GeologicalShapes", "{}_size_pparams".format(axis))
+            dist_params = [float(v) for v in dist_params[1:-1].split(',')]
+            self.geo_size_gens.append(
+                rvg.TheoreticalDistribution(dist_name, dist_params))
+
+        file_path = cfg.get("DrillHoles", "sizes_file")
+        self.drill_size_gen = rvg.EmpiricalDistribution(read_file(file_path))
+
+        # Optional bank of precomputed shapes, opened by openBank() before
+        # the first level is created
+        self.shape_bank = None
+        self.bank_reuse = cfg.getfloat(
+            "GeologicalShapes", "bank_reuse", fallback=1.0)
+        self.bank_size = cfg.getint("GeologicalShapes", "bank_size", fallback=0)
+
+    def getInt(self, section, key):
+        return int(self.cfg.get(section, key))
+
+    def openBank(self):
+        """
+        Open the shape bank, if the config asks for one, building it if
+        it does not exist yet or was built with other settings. Nothing
+        is built until a mine is actually created, so dry runs such as
+        size estimates leave the bank alone.
+        """
+        if self.shape_bank is not None or self.bank_size == 0:
+            return
+        settings = {
+            key: self.cfg.get("GeologicalShapes", key)
+            for key in ["x_size_pname", "x_size_pparams",
+                        "y_size_pname", "y_size_pparams",
+                        "z_size_pname", "z_size_pparams"]}
+        settings["bank_size"] = self.bank_size
+        # Banks are drawn from the settings, and built again whenever the
+        # code that grows the shapes changes
+        seed = int(hashlib.sha256(
+            json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16], 16)
+        settings["code_version"] = self.version
+        key = hashlib.sha256(
+            json.dumps(settings, sort_keys=True).encode()).hexdigest()
+        self.shape_bank = ShapeBank.open(
+            self.cfg.get("GeologicalShapes", "bank_file",
+                         fallback=DEFAULT_BANK_FILE),
+            self.bank_size, self.geo_size_gens, key, seed)
+
+    def layout(self, seed=None):
+        """
+        Draw the number of levels, the number of shapes and drill holes
+        of each level, and the position of the elevator. Returns them as
+        a tuple (num_floors, shapes, drillholes, elevator). If @seed is
+        given, each of them is drawn from a seed of its own, so that
+        changing the settings of one does not affect the others.
+        """
+        def reseed(part):
+            if seed is not None:
+                seedAll(deriveSeed(seed, part))
+
+        # Create a random number of floors
+        reseed("floors")
+        num_floors = int(random.uniform(
+            self.getInt("Floor", "min"),
+            self.getInt("Floor", "max")))
+
+        # Geological shapes can span several floors, so we choose only a few
+        # floors from where the shapes will grow.
+        # We also handle the possible situation in which we have more samples
+        # (num_floors) than population (num_shapes).
+        reseed("shapes")
+        shapes = self.shapeDistribution(num_floors)
+        reseed("drillholes")
+        drillholes = self.drillDistribution(num_floors)
+
+        print("Floors: {}".format(num_floors))
+        print("Shapes: {}, distribution: {}".format(sum(shapes), shapes))
+        print("Drills: {}, distribution: {}".format(sum(drillholes), drillholes))
+
+        # Determine an initial seed which is where all floors will connect.
+        # This is to mimic the existence of an elevator.
+        grid_cols = self.getInt("Floor", "grid_cols")
+        grid_rows = self.getInt("Floor", "grid_rows")
+        if self.tiles is not None:
+            grid_cols *= self.tiles[0]
+            grid_rows *= self.tiles[1]
+        reseed("elevator")
+        elevator = (random.randint(0, grid_cols-1), random.randint(0, grid_rows-1))
+        return num_floors, shapes, drillholes, elevator
+
+    def shapeDistribution(self, num_floors):
+        """
+        Determine how many shapes to create on each floor.
+        """
+        return genDistribution(
+            self.getInt("GeologicalShapes", "min"),
+            self.getInt("GeologicalShapes", "max"),
+            num_floors)
+
+    def drillDistribution(self, num_floors):
+        """
+        Determine how many drill holes to create on each floor.
+        """
+        return genDistribution(
+            self.getInt("DrillHoles", "min"),
+            self.getInt("DrillHoles", "max"),
+            num_floors)
+
+    def newLevel(self, num_drills, num_shapes, elevator, gates=(),
+                 origin=(0, 0)):
+        """
+        Return the MapGen of a level, before any of its stages has run.
+        The objects spilled by the previous level are released. Tiles
+        also take their @gates and @origin (see tiles.Tiling).
+        """
+        if self.spill is not None:
+            self.spill.release()
+        return MapGen(
+            self.drill_size_gen,
+            self.geo_size_gens,
+            cols = self.getInt("Floor", "grid_cols"),
+            rows = self.getInt("Floor", "grid_rows"),
+            min_seeds  = self.getInt("Floor", "min_seeds"),
+            max_seeds  = self.getInt("Floor", "max_seeds"),
+            cell_height = self.getInt("Floor", "cell_height"),
+            cell_width  = self.getInt("Floor", "cell_width"),
+            elevator_coords = elevator,
+            num_drills = num_drills,
+            drill_ival_length = self.getInt("DrillHoles", "interval_length"),
+            drill_clearance = self.cfg.getfloat(
+                "DrillHoles", "min_clearance", fallback=0),
+            clearance_attempts = self.cfg.getint(
+                "DrillHoles", "clearance_attempts", fallback=10),
+            num_shapes = num_shapes,
+            shape_bank = self.shape_bank,
+            bank_reuse = self.bank_reuse,
+            spill = self.spill,
+            gates = gates,
+            origin = origin,
+            shaft_top = self.shaft_top,
+            wall_refinement = self.cfg.getint(
+                "Floor", "wall_refinement", fallback=0),
+            rough_walls = self.cfg.getboolean(
+                "Floor", "rough_walls", fallback=False),
+            shape_refinement = self.cfg.getint(
+                "GeologicalShapes", "surface_refinement", fallback=0),
+            rough_shapes = self.cfg.getboolean(
+                "GeologicalShapes", "rough_surfaces", fallback=False),
+            reject_overlaps = self.cfg.getboolean(
+                "GeologicalShapes", "reject_overlaps", fallback=False)
+        )
+
+    def createLevel(self, level, num_levels, num_drills, num_shapes, elevator,
+                    seed=None):
+        """
+        Create a single level of the mine. See MapGen.create(). If @seed
+        is given, each stage of the level is generated from a seed of its
+        own derived from it.
+        """
+        if seed is None:
+            floor = self.newLevel(num_drills, num_shapes, elevator)
+            floor.create(level, num_levels)
+        else:
+            print("Processing level {}".format(level))
+            seedAll(deriveSeed(seed, level, "corridors"))
+            floor = self.newLevel(num_drills, num_shapes, elevator)
+            for stage in MapGen.STAGES:
+                seedAll(deriveSeed(seed, level, stage))
+                floor.createStage(stage, level, num_levels)
+        if self.spill is not None:
+            print(self.spill.report())
+        return floor
+
+    def openSpill(self, output_dir=None):
+        """
+        Set up the memory budget of the levels about to be created, if
+        any. Spilled objects go to a directory of @output_dir, or to the
+        system's temporary directory.
+        """
+        if self.max_memory is not None:
+            directory = None
+            if output_dir is not None:
+                directory = os.path.join(output_dir, SPILL_DIR)
+            self.spill = SpillArea(self.max_memory, directory)
+
+    def closeSpill(self):
+        """
+        Remove the objects spilled by the last level.
+        """
+        if self.spill is not None:
+            self.spill.release()
+            if self.spill.directory is not None:
+                shutil.rmtree(self.spill.directory, ignore_errors=True)
+            self.spill = None
+
+    def generate(self, output_dir, seed=None, target_rows=None, target_bytes=None):
+        """
+        Create a whole mine and export it to @output_dir. The layout of the
+        mine is drawn from @seed (a random one if not given), and each level
+        is then generated from a seed of its own derived from it.
+
+        When a target number of rows and/or bytes is given, levels are added
+        until it is reached. Each batch of levels draws new drill hole and
+        shape distributions, and the elevator is created once the last level
+        is known.
+        """
+        if seed is None:
+            seed = random.SystemRandom().randrange(1 << 32)
+        print("Seed: {}".format(seed))
+        self.openBank()
+        num_floors, shapes, drillholes, elevator = self.layout(seed)
+        if self.incremental:
+            os.makedirs(output_dir, exist_ok=True)
+        else:
+            prepareOutputDir(output_dir)
+        self.openSpill(output_dir)
+
+        targeted = target_rows is not None or target_bytes is not None
+        num_blocks, num_rows, num_bytes = 0, 0, 0
+        levels, table_rows = [], []
+        start = time.time()
+        i = 0
+        while i < num_floors or targeted:
+            if i > 0 and i % num_floors == 0:
+                shapes = self.shapeDistribution(num_floors)
+                drillholes = self.drillDistribution(num_floors)
+            level = [
+                i, None if targeted else num_floors,
+                drillholes[i % num_floors], shapes[i % num_floors], elevator]
+            floor, stats = self.writeLevel(output_dir, seed, *level)
+            num_blocks += stats["blocks"]
+            num_rows += stats["rows"]
+            num_bytes += stats["bytes"]
+            levels.append({"drills": [level[2]], "shapes": level[3]})
+            table_rows.append(stats["table_rows"])
+            i += 1
+
+            if targeted and \
+                (target_rows is None or num_rows >= target_rows) and \
+                (target_bytes is None or num_bytes >= target_bytes):
+                if i > 1:
+                    # Rewrite the last level now that it holds the elevator
+                    for fname in levelFiles(i-1, output_dir):
+                        os.unlink(fname)
+                    level[1] = i
+                    _, last = self.writeLevel(output_dir, seed, *level, floor=floor)
+                    num_rows += last["rows"] - stats["rows"]
+                    num_bytes += last["bytes"] - stats["bytes"]
+                    table_rows[-1] = last["table_rows"]
+                break
+
+        self.closeSpill()
+        if self.incremental:
+            removeLevels(output_dir, i)
+        writeMetadata(output_dir, {
+            "seed": seed,
+            "config": configDigest(self.cfg, ["Floor"]),
+            "output": self.exporter.settings(),
+            "elevator": list(elevator),
+            "levels": levels,
+            "last_ids": {
+                table: sum(rows[table] for rows in table_rows)
+                for table in TABLES},
+            "appends": 0,
+            "tiles": self.tiles
+        })
+        print("Blocks: {}".format(num_blocks))
+        if targeted:
+            elapsed = max(time.time() - start, 1e-9)
+            print("Levels: {}, rows: {}, bytes: {}".format(i, num_rows, num_bytes))
+            print("Throughput: {:.1f} rows/s, {:.2f} MB/s".format(
+                num_rows / elapsed, num_bytes / elapsed / 1e6))
+        return num_blocks
+
+    def writeLevel(self, output_dir, seed, level, num_levels, num_drills,
+                   num_shapes, elevator, floor=None):
+        """
+        Create a level and export it to @output_dir, or restore it from
+        the cache. In incremental mode the level is updated instead (see
+        updateLevel()). If @floor is given, it is reused instead of being
+        created again (its elevator is added when @num_levels is known).
+        Returns the MapGen of the level (None when restored from the
+        cache) and a dictionary with its number of blocks, rows and bytes.
+        """
+        if self.incremental:
+            return self.updateLevel(
+                output_dir, seed, level, num_levels, num_drills,
+                num_shapes, elevator)
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(
+                config = configDigest(self.cfg, CACHED_SECTIONS),
+                output = self.exporter.settings(),
+                seed = seed,
+                level = level,
+                num_levels = num_levels,
+                num_drills = num_drills,
+                num_shapes = num_shapes,
+                elevator = list(elevator),
+                queries = self.queries,
+                tiles = self.tiles,
+                shaft_top = self.shaft_top)
+            stats = self.cache.fetch(key, output_dir)
+            if stats is not None:
+                print("Level {} restored from cache".format(level))
+                return None, stats
+
+        if self.tiles is not None:
+            floor = None
+            stats = self.writeTiles(
+                output_dir, seed, level, num_levels, num_drills,
+                num_shapes, elevator)
+            files = levelFiles(level, output_dir)
+        else:
+            if floor is None:
+                floor = self.createLevel(
+                    level, num_levels, num_drills, num_shapes, elevator, seed)
+            elif num_levels is not None:
+                floor.createElevator(num_levels)
+
+            # Export results
+            self.exporter.write(level, floor, output_dir)
+            if self.queries > 0:
+                self.writeQueries(output_dir, seed, level, floor)
+            files = levelFiles(level, output_dir)
+            stats = self.levelStats(floor, files)
+        if self.cache is not None:
+            self.cache.store(key, files, **stats)
+        return floor, stats
+
+    def stageKeys(self, seed, level, num_levels, num_drills, num_shapes, elevator):
+        """
+        Compute the key of each stage of a level, plus the keys of the
+        walls and of the segments, which only depend on the corridors and
+        their refinement, and on the drill holes and their interval
+        length. Keys hash the settings each stage depends on along with
+        the key of the stage it builds upon.
+        """
+        def digest(**parts):
+            parts["code_version"] = self.version
+            return hashlib.sha256(
+                json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+        floor = {key: self.cfg.get("Floor", key) for key in [
+            "grid_cols", "grid_rows", "cell_height", "cell_width",
+            "min_seeds", "max_seeds"]}
+        keys = OrderedDict()
+        keys["corridors"] = digest(
+            floor = floor,
+            seed = seed,
+            level = level,
+            elevator = list(elevator),
+            num_levels = num_levels if level == (num_levels or 0) - 1 else None)
+        keys["walls"] = digest(
+            corridors = keys["corridors"],
+            refinement = [
+                self.cfg.get("Floor", key, fallback=None)
+                for key in ["wall_refinement", "rough_walls"]])
+        keys["drillholes"] = digest(
+            corridors = keys["corridors"],
+            num_drills = num_drills,
+            sizes = fileDigest(self.cfg.get("DrillHoles", "sizes_file")),
+            clearance = [
+                self.cfg.get("DrillHoles", key, fallback=None)
+                for key in ["min_clearance", "clearance_attempts"]])
+        keys["segments"] = digest(
+            drillholes = keys["drillholes"],
+            interval_length = self.cfg.get("DrillHoles", "interval_length"))
+        keys["shapes"] = digest(
+            drillholes = keys["drillholes"],
+            num_shapes = num_shapes,
+            shapes = configDigest(self.cfg, ["GeologicalShapes"]))
+        return keys
+
+    def updateLevel(self, output_dir, seed, level, num_levels, num_drills,
+                    num_shapes, elevator):
+        """
+        Bring a level previously written to @output_dir up to date. Stages
+        whose settings did not change are restored from the state saved
+        by the previous run, and only the tables that depend on changed
+        stages (or on changed output settings) are written again.
+        Partitioned output is rewritten as a whole, as all of its tables
+        share the same partitions.
+        """
+        state_path = os.path.join(
+            output_dir, STATE_DIR, "level_{:02d}.pkl".format(level))
+        state = {"stages": {}, "tables": {}}
+        if os.path.exists(state_path):
+            with open(state_path, "rb") as f:
+                state = pickle.load(f)
+
+        keys = self.stageKeys(
+            seed, level, num_levels, num_drills, num_shapes, elevator)
+        floor = None
+        for stage in MapGen.STAGES:
+            saved = state["stages"].get(stage)
+            if floor is None:
+                seedAll(deriveSeed(seed, level, "corridors"))
+                floor = self.newLevel(num_drills, num_shapes, elevator)
+            if saved is not None and saved["key"] == keys[stage]:
+                floor.restoreStage(stage, saved["state"])
+                continue
+            print("Processing level {}, stage {}".format(level, stage))
+            seedAll(deriveSeed(seed, level, stage))
+            floor.createStage(stage, level, num_levels)
+            state["stages"][stage] = {
+                "key": keys[stage], "state": floor.stageState(stage)}
+
+        # Tables that are out of date or missing. The format of the block
+        # model and of the mine working only affect their own tables.
+        table_keys = {}
+        for table in TABLES:
+            settings = self.exporter.settings()
+            if table != "blockmodel":
+                del settings["blockmodel_format"]
+            if table != "mineworking":
+                del settings["mineworking_format"]
+            table_keys[table] = \
+                keys[TABLE_STAGES[table]] + json.dumps(settings, sort_keys=True)
+        tables = [
+            table for table in TABLES
+            if state["tables"].get(table) != table_keys[table] or
+                len(tableFiles(table, level, output_dir)) == 0]
+        if len(tables) > 0 and self.exporter.partitioner is not None:
+            tables = TABLES
+        for table in tables:
+            for fname in tableFiles(table, level, output_dir):
+                os.unlink(fname)
+        if len(tables) > 0:
+            self.exporter.write(level, floor, output_dir, tables)
+            state["tables"].update((table, table_keys[table]) for table in tables)
+
+        # Queries depend on all tables
+        queries_key = None
+        if self.queries > 0:
+            queries_key = "".join(sorted(table_keys.values())) + str(self.queries)
+        queries_file = tableFiles("queries", level, output_dir)
+        if queries_key != state.get("queries") or \
+            len(queries_file) != (queries_key is not None):
+            for fname in queries_file:
+                os.unlink(fname)
+            if queries_key is not None:
+                self.writeQueries(output_dir, seed, level, floor)
+            state["queries"] = queries_key
+        elif len(tables) == 0:
+            print("Level {} is up to date".format(level))
+
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        with open(state_path, "wb") as f:
+            pickle.dump(state, f)
+        return floor, self.levelStats(floor, levelFiles(level, output_dir))
+
+    def tiling(self):
+        """
+        Return the tiles.Tiling of the levels of the mine.
+        """
+        return Tiling(
+            self.tiles,
+            self.getInt("Floor", "grid_cols"),
+            self.getInt("Floor", "grid_rows"))
+
+    def writeTiles(self, output_dir, seed, level, num_levels, num_drills,
+                   num_shapes, elevator):
+        """
+        Create a level as a set of tiles and export each one to files of
+        its own, as soon as it is done. Drill holes and shapes are spread
+        over the tiles, which are created independently from each other
+        by a pool of worker processes (or by this one if @self.jobs is 1),
+        so that memory use is bounded by the size of a tile. Returns the
+        number of blocks, rows and bytes of the level.
+        """
+        tiling = self.tiling()
+        seedAll(deriveSeed(seed, level, "tiles"))
+        drills = genDistribution(num_drills, num_drills, len(tiling))
+        shapes = genDistribution(num_shapes, num_shapes, len(tiling))
+        tasks = [
+            (output_dir, seed, level, num_levels, tile, drills[n], shapes[n],
+             elevator)
+            for n, tile in enumerate(tiling)]
+
+        blocks = 0
+        table_rows = OrderedDict((table, 0) for table in TABLES)
+        networks = {}
+        def done(tile, stats, network):
+            nonlocal blocks
+            print("Level {}, {} written".format(level, tiling.name(tile)))
+            blocks += stats["blocks"]
+            for table, rows in stats["table_rows"].items():
+                table_rows[table] += rows
+            networks[tile] = network
+
+        if self.jobs == 1:
+            for task in tasks:
+                done(*self.writeTile(*task))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.jobs,
+                    initializer=_initWorker,
+                    initargs=(self,)) as executor:
+                futures = [executor.submit(_writeTile, task) for task in tasks]
+                for future in concurrent.futures.as_completed(futures):
+                    done(*future.result())
+
+        # Distances from the elevator run through the gates, across tiles
+        if self.exporter.network:
+            self.exporter.writeTileNodes(
+                level, [(tiling.name(tile), networks[tile]) for tile in tiling],
+                output_dir)
+
+        return {
+            "blocks": blocks,
+            "rows": sum(table_rows.values()),
+            "table_rows": table_rows,
+            "bytes": sum(os.path.getsize(f) for f in levelFiles(level, output_dir))
+        }
+
+    def writeTile(self, output_dir, seed, level, num_levels, tile, num_drills,
+                  num_shapes, elevator):
+        """
+        Create a single tile of a level, from seeds of its own, and export
+        it. Returns the tile along with its number of blocks and rows, and
+        its corridor network, whose nodes are written once all tiles are.
+        """
+        tiling = self.tiling()
+        name = tiling.name(tile)
+        print("Processing level {}, {}".format(level, name))
+        path = (level, "tile") + tuple(tile)
+        seedAll(deriveSeed(seed, *path, "corridors"))
+        floor = self.newLevel(
+            num_drills, num_shapes, tiling.local(elevator, tile),
+            gates = tiling.gates(tile, deriveSeed(seed, level, "gates")),
+            origin = tiling.origin(tile))
+        for stage in MapGen.STAGES:
+            seedAll(deriveSeed(seed, *path, stage))
+            floor.createStage(stage, level, num_levels)
+        if self.spill is not None:
+            print(self.spill.report())
+
+        self.exporter.write(level, floor, output_dir, batch=name, nodes=False)
+        if self.queries > 0:
+            self.writeQueries(output_dir, seed, level, floor, tile)
+        network = None
+        if self.exporter.network:
+            network = CorridorNetwork(floor, level)
+        return tile, self.levelStats(floor, []), network
+
+    def writeQueries(self, output_dir, seed, level, floor, tile=None):
+        """
+        Write the query workload of a level, or of a @tile of it, drawn
+        from a seed of its own.
+        """
+        path, batch = (level,), None
+        if tile is not None:
+            path += ("tile",) + tuple(tile)
+            batch = self.tiling().name(tile)
+        writeQueries(
+            level, floor, output_dir, self.queries,
+            deriveSeed(seed, *path, "queries"), batch)
+
+    def levelStats(self, floor, files, tables=TABLES):
+        """
+        Number of blocks, rows (in total and per table) and bytes of the
+        given @tables of a level, once written to @files.
+        """
+        table_rows = OrderedDict(
+            (table, self.exporter.countRows(floor, table)) for table in tables)
+        return {
+            "blocks": sum([len(shp.block_indexes) for shp in floor.shapes]),
+            "rows": sum(table_rows.values()),
+            "table_rows": table_rows,
+            "bytes": sum(os.path.getsize(f) for f in files)
+        }
+
+    def append(self, output_dir, add_levels=0, add_drills=0):
+        """
+        Grow the mine previously written to @output_dir, as described by
+        its metadata file, without rewriting any of its files. @add_levels
+        new levels are created below the existing ones, the last of them
+        holding the elevator shaft from the former last level down.
+        @add_drills drill holes are spread over the existing levels, and
+        written to files of their own (along with their segments and
+        points).
+        """
+        meta = readMetadata(output_dir)
+        if meta.get("tiles") is not None:
+            raise ValueError("mines of tiled levels cannot be appended to")
+        if meta["config"] != configDigest(self.cfg, ["Floor"]):
+            raise ValueError(
+                "the [Floor] settings differ from those of the existing mine")
+        if meta["output"] != json.loads(json.dumps(self.exporter.settings())):
+            raise ValueError(
+                "the output options differ from those of the existing mine")
+
+        seed = meta["seed"]
+        elevator = tuple(meta["elevator"])
+        levels = meta["levels"]
+        last_ids = meta["last_ids"]
+        num_levels = len(levels)
+        self.openBank()
+        seedAll(deriveSeed(seed, "append", meta["appends"]))
+        print("Seed: {}".format(seed))
+        self.openSpill(output_dir)
+
+        if add_drills > 0:
+            distribution = genDistribution(add_drills, add_drills, num_levels)
+            print("Drills: {}, distribution: {}".format(add_drills, distribution))
+            for level, num_drills in enumerate(distribution):
+                if num_drills == 0:
+                    continue
+                # Drill holes need the corridors of their level, which
+                # are created again from the seed of the level
+                batch = len(levels[level]["drills"])
+                print("Processing level {}, drill batch {}".format(level, batch))
+                seedAll(deriveSeed(seed, level, "corridors"))
+                floor = self.newLevel(num_drills, 0, elevator)
+                seedAll(deriveSeed(seed, level, "corridors"))
+                floor.createStage("corridors", level, None)
+                seedAll(deriveSeed(seed, level, "drillholes", batch))
+                floor.createStage("drillholes", level, None)
+                self.exporter.write(
+                    level, floor, output_dir, APPENDED_TABLES,
+                    "drills_{:02d}".format(batch))
+                stats = self.levelStats(floor, [], APPENDED_TABLES)
+                for table, rows in stats["table_rows"].items():
+                    last_ids[table] += rows
+                levels[level]["drills"].append(num_drills)
+
+        if add_levels > 0:
+            shapes = self.shapeDistribution(add_levels)
+            drillholes = self.drillDistribution(add_levels)
+            total = num_levels + add_levels
+            # The files of the former last level keep its elevator shaft,
+            # so the new last level only holds the part of the shaft that
+            # goes on from there
+            self.shaft_top = num_levels - 1
+            for k in range(add_levels):
+                level = num_levels + k
+                _, stats = self.writeLevel(
+                    output_dir, seed, level, total, drillholes[k], shapes[k],
+                    elevator)
+                for table, rows in stats["table_rows"].items():
+                    last_ids[table] += rows
+                levels.append({"drills": [drillholes[k]], "shapes": shapes[k]})
+
+        self.shaft_top = 0
+        self.closeSpill()
+        meta["appends"] += 1
+        writeMetadata(output_dir, meta)
+
+    def generateBatch(self, output_dir, count, seed=None, jobs=None, **kwargs):
+        """
+        Create @count independent mines, each one in its own subdirectory
+        of @output_dir and with a seed derived from @seed. Mines are
+        generated by a pool of @jobs worker processes that inherit this
+        generator, so the distributions are built only once. Extra
+        arguments are passed on to generate().
+        """
+        if seed is None:
+            seed = random.SystemRandom().randrange(1 << 32)
+        seeds = deriveSeeds(seed, count)
+        width = len(str(count-1))
+        dirs = [
+            os.path.join(output_dir, "mine_{:0{}d}".format(k, width))
+            for k in range(count)]
+
+        # Workers share the bank of this generator
+        self.openBank()
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=_initWorker,
+                initargs=(self,)) as executor:
+            tasks = [
+                executor.submit(_generateMine, mine_dir, mine_seed, kwargs)
+                for mine_dir, mine_seed in zip(dirs, seeds)]
+            for mine_dir, mine_seed, task in zip(dirs, seeds, tasks):
+                task.result()
+                print("Mine {} written with seed {}".format(mine_dir, mine_seed))
+
+    def records(self, seed=None, tables=TABLES):
+        """
+        Create a whole mine, as generate() would with the same @seed, but
+        yield the rows of the given @tables as records.Record objects
+        instead of writing them. Levels are created one at a time, as the
+        records of the previous one are consumed. Tiled levels are not
+        supported.
+        """
+        if self.tiles is not None:
+            raise ValueError("records of tiled levels are not supported")
+        if seed is None:
+            seed = random.SystemRandom().randrange(1 << 32)
+        self.openBank()
+        num_floors, shapes, drillholes, elevator = self.layout(seed)
+        self.openSpill()
+        try:
+            for level in range(num_floors):
+                floor = self.createLevel(
+                    level, num_floors, drillholes[level], shapes[level],
+                    elevator, seed)
+                yield from levelRecords(level, floor, tables)
+        finally:
+            self.closeSpill()
+
+
+# Generator of the worker processes, along with its distributions
+_batch_generator = None
+
+def _initWorker(generator):
+    global _batch_generator
+    _batch_generator = generator
+    # Workers do not start worker processes of their own
+    _batch_generator.jobs = 1
+    if _batch_generator.exporter is not None:
+        _batch_generator.exporter.jobs = 1
+
+def _generateMine(output_dir, seed, kwargs):
+    return _batch_generator.generate(output_dir, seed, **kwargs)
+
+def _writeTile(task):
+    return _batch_generator.writeTile(*task)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Corridor network. The corridor cells of a level make up a graph whose
+# nodes are the cells and whose edges join neighboring cells, so that it
+# can be loaded into routing engines as is. The elevator links the cells
+# beneath it from one level to the next, and each node comes with its
+# shortest distance from the elevator of the first level, computed on
+# sparse arrays rather than after the network is loaded.
+
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+from src.geometry import Line, Point
+import numpy as np
+
+# Depth between consecutive levels, in cell heights (see the padding of
+# MineWorkingCell)
+LEVEL_SPACING = 25
+
+def nodeId(level, col, row):
+    """
+    Identifier of the node of the cell at (@col, @row) of @level, unique
+    across the mine. Columns and rows are those of the whole level, even
+    if it is tiled.
+    """
+    return (level << 40) | (row << 20) | col
+
+
+class CorridorNetwork:
+    """
+    The graph of the corridors of @the_map, which is @level of the mine.
+    Nodes are the corridor cells, in the order of the mineworking table.
+    """
+    def __init__(self, the_map, level):
+        self.level = level
+        cells = the_map.corridor
+        col0, row0 = the_map.origin
+        local = np.array(
+            [[cell.col, cell.row] for cell in cells], dtype=np.int64).reshape(-1, 2)
+        self.coords = local + [col0, row0]
+        self.points = np.array(
+            [[cell.pcenter.x, cell.pcenter.y, cell.pcenter.z] for cell in cells],
+            dtype=np.float64).reshape(-1, 3)
+        self.ids = nodeId(level, self.coords[:, 0], self.coords[:, 1])
+        self.spacing = the_map.cell_height * LEVEL_SPACING
+
+        # Edges towards the east and south neighbors of each cell
+        index = {(col, row): n for n, (col, row) in enumerate(local.tolist())}
+        sources, targets = [], []
+        for n, (col, row) in enumerate(local.tolist()):
+            for neighbor in [(col+1, row), (col, row+1)]:
+                if neighbor in index:
+                    sources.append(n)
+                    targets.append(index[neighbor])
+        self.sources = np.array(sources, dtype=np.int64)
+        self.targets = np.array(targets, dtype=np.int64)
+        self.length = float(the_map.cell_width)
+
+        # Gates open onto the next tile, whose network holds the edges
+        # through the gates that face this tile
+        self.gates = [
+            (index[cell], int(col == the_map.cols), int(row == the_map.rows))
+            for cell, (col, row) in the_map.gates
+            if col == the_map.cols or row == the_map.rows]
+
+        # Cell beneath the elevator, if the corridors reach it
+        self.elevator = None
+        if the_map.elevator_coords is not None:
+            self.elevator = index.get(tuple(the_map.elevator_coords))
+
+    def distances(self):
+        """
+        Shortest distance from the elevator of the first level to each
+        node, going down the elevator shaft and then along the corridors
+        of this level, or -1 for the nodes that the corridors do not
+        connect to the elevator. Tiles of a level need the networks of
+        the other tiles (see levelDistances()).
+        """
+        return levelDistances([self])[0]
+
+    def nodes(self, distances=None):
+        """
+        List of (id, point, distance) nodes, with the given @distances
+        or those of distances().
+        """
+        if distances is None:
+            distances = self.distances()
+        return [
+            (node, Point(*point), distance)
+            for node, point, distance in zip(
+                self.ids.tolist(), self.points.tolist(), distances.tolist())]
+
+    def edges(self):
+        """
+        List of (source, target, length, line) edges, where source and
+        target are node ids. Edges through the gates of a tiled level and
+        up the elevator shaft lead to nodes of other tiles or levels.
+        """
+        edges = [
+            (self.ids[s], self.ids[t], self.length,
+             Line(Point(*self.points[s].tolist()), Point(*self.points[t].tolist())))
+            for s, t in zip(self.sources.tolist(), self.targets.tolist())]
+        for n, dcol, drow in self.gates:
+            col, row = self.coords[n].tolist()
+            p1 = self.points[n].tolist()
+            p2 = [p1[0] + dcol * self.length, p1[1] + drow * self.length, p1[2]]
+            edges.append((
+                self.ids[n], nodeId(self.level, col+dcol, row+drow), self.length,
+                Line(Point(*p1), Point(*p2))))
+        if self.elevator is not None and self.level > 0:
+            col, row = self.coords[self.elevator].tolist()
+            p1 = self.points[self.elevator].tolist()
+            p2 = [p1[0], p1[1], p1[2] + self.spacing]
+            edges.append((
+                self.ids[self.elevator], nodeId(self.level-1, col, row),
+                float(self.spacing), Line(Point(*p1), Point(*p2))))
+        return [(int(s), int(t), length, line) for s, t, length, line in edges]
+
+
+def levelDistances(networks):
+    """
+    Distances of the nodes of each of the @networks of the tiles of a
+    level (see CorridorNetwork.distances()), computed over the whole
+    level: corridors of different tiles are joined through their gates,
+    so that every tile reaches the elevator, wherever it lies.
+    """
+    offsets = np.cumsum([0] + [len(n.ids) for n in networks])
+    num = int(offsets[-1])
+    index = {
+        node: offset + n for network, offset in zip(networks, offsets)
+        for n, node in enumerate(network.ids.tolist())}
+    sources, targets = [], []
+    elevator = None
+    for network, offset in zip(networks, offsets):
+        sources.append(network.sources + offset)
+        targets.append(network.targets + offset)
+        for n, dcol, drow in network.gates:
+            col, row = network.coords[n].tolist()
+            other = index.get(nodeId(network.level, col+dcol, row+drow))
+            if other is not None:
+                sources.append([offset + n])
+                targets.append([other])
+        if network.elevator is not None:
+            elevator = offset + network.elevator
+
+    distances = np.full(num, -1.0)
+    if elevator is not None:
+        sources = np.concatenate(sources).astype(np.int64)
+        targets = np.concatenate(targets).astype(np.int64)
+        graph = coo_matrix(
+            (np.full(len(sources), networks[0].length), (sources, targets)),
+            shape=(num, num)).tocsr()
+        distances = dijkstra(graph, directed=False, indices=elevator)
+        distances += networks[0].level * networks[0].spacing
+        distances[np.isinf(distances)] = -1.0
+    return [distances[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
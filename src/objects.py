@@ -7,6 +7,8 @@ from scipy.spatial import ConvexHull
 from pyhull.delaunay import DelaunayTri
 from collections import OrderedDict
 from src.geometry import *
+from src.blockmodel import BlockModel
+from src.mesh import subdivide
 import numpy as np
 import random
 import math
@@ -44,6 +46,12 @@ class DrillHole:
         self.length = self.size_generator.generate(1)[0]
         self.line.setLength(self.length)
 
+    def __getstate__(self):
+        # The size generator is only needed by create()
+        state = self.__dict__.copy()
+        state["size_generator"] = None
+        return state
+
     def segments(self):
         """
         Split self.line into several line segments of @self.segment_size
@@ -323,15 +331,29 @@ class MineWorkingCell:
 
 
 class GeologicalShape:
-    def __init__(self, xsize, ysize, zsize, max_blocks):
-        self.map = np.empty((xsize, ysize, zsize), dtype=bool)
+    # Edge length of the blocks of the shape
+    CUBE_SIZE = 5
+
+    def __init__(self, xsize, ysize, zsize, max_blocks, rng=None):
+        """
+        @rng is the random.Random instance used to grow the shape. It
+        defaults to the random module itself.
+        """
+        self.map = None
+        self.random = random if rng is None else rng
         self.xsize = xsize
         self.ysize = ysize
         self.zsize = zsize
         self.max_blocks = max_blocks
-        self.block_indexes = []
+        # (N,3) array with the (i, j, k) lattice position of each block
+        self.block_indexes = np.empty((0, 3), dtype=np.int64)
+        self.hull = None
         self.delaunay = None
-        self.cube_size = 5
+        self.points = None
+        self.simplices = None
+        # Triangles of the surface once refined, if it is (see refine())
+        self.triangles = None
+        self.cube_size = self.CUBE_SIZE
 
     def __str__(self):
         grid = ""
@@ -379,40 +401,75 @@ class GeologicalShape:
         # Compute the convex hull of the shape
         self.hull = ConvexHull(vertices)
         self.delaunay = DelaunayTri(self.hull.points)
+        self.points = np.asarray(self.hull.points)
+        self.simplices = np.asarray(self.delaunay.vertices)
+
+    @classmethod
+    def fromTemplate(cls, template, seed, turns=0):
+        """
+        Create a copy of the @template shape grown from @seed instead,
+        rotated by @turns quarter turns around the vertical axis. Blocks
+        stay aligned with the axes, so the block model of the copy is
+        that of the template, turned.
+        """
+        xsize, ysize = template.xsize, template.ysize
+        if turns % 2 == 1:
+            xsize, ysize = ysize, xsize
+        shape = cls(xsize, ysize, template.zsize, template.max_blocks)
+        shape.seed = Point(
+            seed.x, seed.y, seed.z + (shape.zsize/2.0) * shape.cube_size)
+        origin = np.array([template.seed.x, template.seed.y, template.seed.z])
+        points = template.points - origin
+        blocks = np.array(template.block_indexes, dtype=np.int64).reshape(-1, 3)
+        for turn in range(turns % 4):
+            points[:, 0], points[:, 1] = -points[:, 1], points[:, 0].copy()
+            blocks[:, 0], blocks[:, 1] = -blocks[:, 1], blocks[:, 0].copy()
+        shape.points = points + [shape.seed.x, shape.seed.y, shape.seed.z]
+        shape.simplices = template.simplices
+        shape.block_indexes = blocks
+        return shape
 
     def __createGeometry(self):
-        # Initialize the grid
-        for k in range(0, self.map.shape[2], self.cube_size):
-            for i in range(0, self.map.shape[0], self.cube_size):
-                for j in range(0, self.map.shape[1], self.cube_size):
-                    self.map[i,j,k] = False
-
-        random_ysize = random.randrange(self.map.shape[1])
-        random_zsize = random.randrange(self.map.shape[2])
+        self.map = np.zeros((self.xsize, self.ysize, self.zsize), dtype=bool)
+        random_ysize = self.random.randrange(self.map.shape[1])
+        random_zsize = self.random.randrange(self.map.shape[2])
 
-        # Define the shape cells
+        # Draw the y extent of each slab along i and the z extent of each
+        # of its (i, j) columns, slab by slab until max_blocks is reached.
+        # Extents are drawn in the same order as blocks are laid out.
+        s = self.cube_size
+        columns = []
         max_blocks = self.max_blocks
-        for i in range(0, self.xsize, self.cube_size):
-            y_min = random.randrange(random_ysize + 1)
-            y_rand = random.randrange(random_ysize + 1, self.ysize + 1)
+        for i in range(0, self.xsize, s):
+            y_min = self.random.randrange(random_ysize + 1)
+            y_rand = self.random.randrange(random_ysize + 1, self.ysize + 1)
             y_max = self.ysize if random_ysize == self.ysize else y_rand
 
-            for j in range(y_min, y_max, self.cube_size):
-                z_min = random.randrange(random_zsize + 1)
-                z_rand = random.randrange(random_zsize + 1, self.zsize + 1)
-                z_max = self.zsize if random_zsize == self.zsize else z_rand
-
-                for k in range(z_min, z_max, self.cube_size):
-                    # We want to have a mineworking cell here
-                    self.block_indexes.append((i,j,k))
-                    self.map[i,j,k] = True
-                    max_blocks -= 1
+            js = np.arange(y_min, y_max, s, dtype=np.int64)
+            z = np.array([
+                (self.random.randrange(random_zsize + 1),
+                 self.random.randrange(random_zsize + 1, self.zsize + 1))
+                for j in js], dtype=np.int64).reshape(-1, 2)
+            if random_zsize == self.zsize:
+                z[:, 1] = self.zsize
+            columns.append(np.column_stack([np.full(len(js), i), js, z]))
+            max_blocks -= np.maximum(-((z[:, 0] - z[:, 1]) // s), 0).sum()
             if max_blocks <= 0:
                 break
 
+        # Lay out the blocks of each (i, j) column, from z_min up to z_max
+        columns = np.concatenate(columns) if len(columns) else \
+            np.empty((0, 4), dtype=np.int64)
+        counts = np.maximum(-((columns[:, 2] - columns[:, 3]) // s), 0)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        blocks = np.repeat(columns[:, 0:3], counts, axis=0)
+        blocks[:, 2] += offsets * s
+        self.block_indexes = blocks
+        self.map[blocks[:, 0], blocks[:, 1], blocks[:, 2]] = True
+
         # Tell each cell who its neighbors are
         vertices_dict = OrderedDict()
-        for i, j, k in self.block_indexes:
+        for i, j, k in self.block_indexes.tolist():
             neighbors = []
             for (ni, nj, nk) in self.possibleNeighbors(i, j, k):
                 if self.map[ni, nj, nk]:
@@ -431,17 +488,35 @@ class GeologicalShape:
         # Return the list of vertices that compose this shape
         return list(vertices_dict.values())
 
+    def surface(self):
+        """
+        Return a (T,3,3) array with the triangles of the surface of the
+        shape, that is, the first face of each simplex of its hull.
+        """
+        if self.triangles is not None:
+            return self.triangles
+        return self.points[self.simplices[:, 0:3]]
+
+    def refine(self, levels, preserve_shape=True, rng=np.random):
+        """
+        Replace the triangles of the surface with those of their
+        subdivision (see mesh.subdivide()).
+        """
+        if levels > 0:
+            self.triangles = subdivide(
+                self.surface(), levels, preserve_shape, rng)
+
     def geom(self, postgis_output=True):
         """
         WKT representation of this geometry.
         """
         fmt = "POLYHEDRALSURFACEZ(" + (postgis_output * "\n")
-        for index in np.asarray(self.delaunay.vertices):
+        for triangle in self.surface():
             fmt += "(("
-            for p in self.hull.points[index][0:3]:
+            for p in triangle:
                 fmt += "{} {} {},".format(p[0], p[1], p[2])
             # Repeat the first point
-            p = self.hull.points[index][0]
+            p = triangle[0]
             fmt += "{} {} {}".format(p[0], p[1], p[2])
             fmt += "))," + (postgis_output * "\n")
         if postgis_output:
@@ -452,20 +527,4 @@ class GeologicalShape:
         """
         List of WKT strings representing all blockmodels within this geometry.
         """
-        fmt = ""
-        for idx, (i, j, k) in enumerate(self.block_indexes):
-            cell = MineWorkingCell(
-                    i, j,
-                    self.cube_size, self.cube_size,
-                    level=k,
-                    padding=1,
-                    cell_type=MineWorkingCell.BLOCK)
-            cell.translate(self.seed)
-            terminator = "," if idx < len(self.block_indexes)-1 else ""
-            if postgis_output:
-                fmt += "('"
-                fmt += cell.asBlock(self.cube_size)
-                fmt += "'){}\n".format(terminator)
-            else:
-                fmt += "{}\n".format(cell.asBlock(self.cube_size))
-        return fmt
+        return BlockModel.fromShape(self).blockmodelGeom(postgis_output)
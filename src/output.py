@@ -3,17 +3,444 @@
 
 # Output producer.
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from src import entities
+from src.blockmodel import BlockModel, BlockModelSet
+from src.mesh import IndexedMesh
+from src.voxels import segmentBlocks
+from src.overlaps import shapeOverlaps
+from src.network import CorridorNetwork, levelDistances
+from src.geometry import Line, Point
+import concurrent.futures
+import numpy as np
+import itertools
+import glob
+import math
 import os
 
-class PostGIS:
-    def __init__(self):
+# Tables produced for each level, in export order
+TABLES = [
+    "mineworking",
+    "drillholes",
+    "multiline_drillholes",
+    "segments",
+    "points",
+    "geological_shapes",
+    "blockmodel"
+]
+
+def levelFiles(level, output_dir):
+    """
+    Return the paths of all files written for @level to @output_dir,
+    sidecars included.
+    """
+    pattern = "*.level_{:02d}.*".format(level)
+    return sorted(glob.glob(os.path.join(output_dir, pattern)))
+
+def tableFiles(table, level, output_dir):
+    """
+    Return the paths of the files written for @table of @level to
+    @output_dir, sidecars and partitions included.
+    """
+    pattern = "{}.level_{:02d}.*".format(table, level)
+    return sorted(glob.glob(os.path.join(output_dir, pattern)))
+
+def tableFileName(table, level, extension, *parts):
+    """
+    Name of the file of @table of @level. Optional @parts (e.g., the
+    partition) are inserted between the level and the @extension.
+    """
+    return ".".join(
+        ["{}.level_{:02d}".format(table, level)] + list(parts) + [extension])
+
+
+# Rows formatted by each task when the largest tables (blockmodel and
+# segments) are written by several processes
+CHUNK_ROWS = 20000
+
+def blockTasks(the_map, postgis_output):
+    """
+    Split the block models of @the_map (a MapGen or a BlockModelSet) into
+    (model, postgis_output, last) tasks of up to CHUNK_ROWS blocks, where
+    @last tells whether the task ends the model of its shape.
+    """
+    for shape in the_map.shapes:
+        model = shape if isinstance(shape, BlockModel) else BlockModel.fromShape(shape)
+        blocks = model.blocks()
+        starts = range(0, max(len(blocks), 1), CHUNK_ROWS)
+        for start in starts:
+            chunk = BlockModel(
+                model.origin, model.cube_size, blocks[start:start+CHUNK_ROWS])
+            yield (chunk, postgis_output, start == starts[-1])
+
+def formatBlocks(task):
+    """
+    Render a (model, postgis_output, last) task of blockTasks() as
+    BlockModel.blockmodelGeom() does. Unless last is set, more blocks of
+    the same model follow, so the last row is terminated as well.
+    """
+    model, postgis_output, last = task
+    text = model.blockmodelGeom(postgis_output)
+    if postgis_output and not last and len(text) > 0:
+        text = text[:-1] + ",\n"
+    return text
+
+def segmentTasks(drills, postgis_output):
+    """
+    Split @drills into (drills, postgis_output, last) tasks of about
+    CHUNK_ROWS segments, where @last tells whether the task holds the
+    last drill hole.
+    """
+    chunk, rows = [], 0
+    for drill in drills:
+        if rows >= CHUNK_ROWS:
+            yield (chunk, postgis_output, False)
+            chunk, rows = [], 0
+        chunk.append(drill)
+        rows += math.ceil(max(drill.length, 0) / drill.segment_size)
+    yield (chunk, postgis_output, True)
+
+def formatSegments(task):
+    """
+    Render the segments of the drill holes of a (drills, postgis_output,
+    last) task of segmentTasks(), one per line. PostGIS rows are
+    terminated unless they are the last row of the table.
+    """
+    drills, postgis_output, last = task
+    row = "('{}'),\n" if postgis_output else "{}\n"
+    text = "".join(
+        row.format(segment.geom())
+        for drill in drills for segment in drill.segments())
+    if postgis_output and last and len(text) > 0:
+        text = text[:-2] + "\n"
+    return text
+
+
+def writeBoundingBoxes(the_map, table, path, groups=None):
+    """
+    Write the bounding boxes of the rows of @table to a sidecar file next
+    to @path. The sidecar holds an (N,6) array named 'bbox' with one
+    (xmin, ymin, zmin, xmax, ymax, zmax) record per row, in the same order
+    as the rows of @path, plus the 'extent' of the whole file.
+    """
+    if groups is None:
+        groups = entities.rowGroups(
+            table,
+            entities.collect(the_map, table),
+            the_map.elevator)
+    bboxes = entities.groupBoundingBoxes(groups)
+    sidecar = "{}.bbox.npz".format(os.path.splitext(path)[0])
+    with open(sidecar, "wb") as f:
+        np.savez(f, bbox=bboxes, extent=entities.extent(bboxes))
+
+
+def writeCompactBlockModel(level, the_map, output_dir, bbox_index=False,
+                           batch=None):
+    """
+    Write the block models of a level in the compact .npz format. Use
+    the expand-blockmodel tool to convert them back into WKT. Files of
+    a @batch (e.g., a tile) are named after it.
+    """
+    print("Exporting results: level {}, compact blockmodel".format(level))
+    parts = [batch] if batch is not None else []
+    fname = tableFileName("blockmodel", level, "npz", *parts)
+    path = os.path.join(output_dir, fname)
+    BlockModelSet.fromMap(the_map).save(path)
+    if bbox_index:
+        writeBoundingBoxes(the_map, "blockmodel", path)
+
+
+def writeMesh(level, the_map, output_dir, fmt, bbox_index=False, batch=None):
+    """
+    Write the mine working of a level as an indexed triangle mesh in
+    @fmt, which is either 'obj' or 'ply'. Files of a @batch (e.g., a
+    tile) are named after it.
+    """
+    print("Exporting results: level {}, mineworking mesh".format(level))
+    parts = [batch] if batch is not None else []
+    fname = tableFileName("mineworking", level, fmt, *parts)
+    path = os.path.join(output_dir, fname)
+    mesh = IndexedMesh.fromMap(the_map)
+    with open(path, "w") as f:
+        if fmt == "obj":
+            mesh.writeObj(f)
+        else:
+            mesh.writePly(f)
+    if bbox_index:
+        groups = [entities.collect(the_map, "mineworking")]
+        writeBoundingBoxes(the_map, "mineworking", path, groups)
+
+
+class Exporter:
+    """
+    Base class of the output producers. Subclasses define the file
+    extension and how tables and partitions are written. The largest
+    tables are formatted by @jobs worker processes (one per CPU if None).
+    """
+    extension = None
+
+    def __init__(self, partitioner=None, bbox_index=False,
+                 blockmodel_format="wkt", mineworking_format="wkt",
+                 segment_blocks=False, shape_overlaps=False, network=False,
+                 jobs=1):
+        self.partitioner = partitioner
+        self.bbox_index = bbox_index
+        self.blockmodel_format = blockmodel_format
+        self.mineworking_format = mineworking_format
+        self.segment_blocks = segment_blocks
+        self.shape_overlaps = shape_overlaps
+        self.network = network
+        self.jobs = jobs
+
+    def write(self, level, the_map, output_dir, tables=TABLES, batch=None,
+              nodes=True):
+        """
+        Export the given @tables of a level (all of them by default) to
+        @output_dir. Files of a @batch appended to an existing level, or
+        of a tile of the level, are named after it, so that they do not
+        replace those of the level. The corridor nodes of tiles are left
+        out unless @nodes is set, as their distances depend on the other
+        tiles (see writeTileNodes()).
+        """
+        if self.partitioner is not None:
+            self.writePartitions(level, the_map, output_dir, tables, batch)
+        else:
+            for table in tables:
+                self.writeLevelTable(level, table, the_map, output_dir, batch)
+        # Links need the blocks that segments cross, which batches of
+        # appended drill holes do not have
+        if self.segment_blocks and ("blockmodel" in tables or \
+            (batch is None and "segments" in tables)):
+            self.writeSegmentBlocks(level, the_map, output_dir, batch)
+        if self.shape_overlaps and "geological_shapes" in tables:
+            self.writeShapeOverlaps(level, the_map, output_dir, batch)
+        if self.network and "mineworking" in tables:
+            self.writeNetwork(level, the_map, output_dir, batch, nodes)
+
+    def settings(self):
+        """
+        Dictionary with the settings that affect the files written.
+        """
+        settings = {
+            "extension": self.extension,
+            "bbox_index": self.bbox_index,
+            "blockmodel_format": self.blockmodel_format,
+            "mineworking_format": self.mineworking_format,
+            "segment_blocks": self.segment_blocks,
+            "shape_overlaps": self.shape_overlaps,
+            "network": self.network,
+            "partition": None
+        }
+        if self.partitioner is not None:
+            settings["partition"] = [
+                self.partitioner.mode,
+                self.partitioner.tile_size,
+                self.partitioner.depth]
+        return settings
+
+    def countRows(self, the_map, table):
+        """
+        Number of rows written to @table for @the_map.
+        """
+        if table == "mineworking" and self.mineworking_format != "wkt":
+            return 1
+        return entities.countRows(the_map, table)
+
+    def partitioned(self, table):
+        """
+        Tell whether @table can be split into spatial partitions. Tables
+        written in compact or mesh formats are always written per level.
+        """
+        if table == "blockmodel":
+            return self.blockmodel_format != "npz"
+        elif table == "mineworking":
+            return self.mineworking_format == "wkt"
+        return True
+
+    def writeLevelTable(self, level, table, the_map, output_dir, batch=None):
+        """
+        Write a table of a level to a single file.
+        """
+        if table == "blockmodel" and self.blockmodel_format == "npz":
+            writeCompactBlockModel(
+                level, the_map, output_dir, self.bbox_index, batch)
+            return
+        elif table == "mineworking" and self.mineworking_format in ["obj", "ply"]:
+            writeMesh(level, the_map, output_dir,
+                self.mineworking_format, self.bbox_index, batch)
+            return
+
+        print("Exporting results: level {}, table {}".format(level, table))
+        parts = [batch] if batch is not None else []
+        fname = tableFileName(table, level, self.extension, *parts)
+        path = os.path.join(output_dir, fname)
+        self.writeTable(table, the_map, path)
+        if self.bbox_index:
+            groups = None
+            if table == "mineworking" and self.mineworking_format == "welded":
+                groups = [entities.collect(the_map, table)]
+            writeBoundingBoxes(the_map, table, path, groups)
+
+    def writePartitions(self, level, the_map, output_dir, tables=TABLES,
+                        batch=None):
+        """
+        Create one output file per spatial partition of each table.
+        """
+        for table in tables:
+            if not self.partitioned(table):
+                self.writeLevelTable(level, table, the_map, output_dir, batch)
+        tables = [t for t in tables if self.partitioned(t)]
+        for table, partition, rows in self.partitioner.split(the_map, tables):
+            print("Exporting results: level {}, table {}, {}".format(
+                level, table, partition))
+            parts = [batch] if batch is not None else []
+            fname = tableFileName(
+                table, level, self.extension, *(parts + [partition]))
+            path = os.path.join(output_dir, fname)
+            self.writeRows(table, path, rows)
+            if self.bbox_index:
+                writeBoundingBoxes(the_map, table, path, rows)
+
+    def writeSegmentBlocks(self, level, the_map, output_dir, batch=None):
+        """
+        Write the table that links each drill hole segment to the blocks
+        it crosses (see voxels.segmentBlocks). Rows hold the level, the
+        drill hole and the position of the segment along it, the shape
+        and the position of the block among its blocks, and the piece of
+        the segment that lies within the block.
+        """
+        print("Exporting results: level {}, table segment_blocks".format(level))
+        parts = [batch] if batch is not None else []
+        fname = tableFileName("segment_blocks", level, self.extension, *parts)
+        links = [
+            (drill, segment, shape, block,
+             Line(Point(*p1.tolist()), Point(*p2.tolist())))
+            for drill, segment, shape, block, p1, p2 in segmentBlocks(the_map)]
+        self.writeLinks(level, links, os.path.join(output_dir, fname))
+
+    def writeShapeOverlaps(self, level, the_map, output_dir, batch=None):
+        """
+        Write the table of the pairs of geological shapes whose convex
+        hulls overlap (see overlaps.shapeOverlaps()). Rows hold the level,
+        the positions of both shapes within the geological_shapes table
+        of the level, and the point that lies deepest within both hulls.
+        """
+        print("Exporting results: level {}, table shape_overlaps".format(level))
+        parts = [batch] if batch is not None else []
+        fname = tableFileName("shape_overlaps", level, self.extension, *parts)
+        overlaps = [
+            (shape, other, Point(*center.tolist()))
+            for shape, other, center in shapeOverlaps(the_map.shapes)]
+        self.writeOverlaps(level, overlaps, os.path.join(output_dir, fname))
+
+    def writeNetwork(self, level, the_map, output_dir, batch=None, nodes=True):
+        """
+        Write the corridor network of a level as a routable graph (see
+        network.CorridorNetwork): the corridor_nodes table, with the id,
+        distance from the elevator and point of each node, if @nodes is
+        set, and the corridor_edges table, with the source, target,
+        length and line of each edge.
+        """
+        print("Exporting results: level {}, corridor network".format(level))
+        parts = [batch] if batch is not None else []
+        network = CorridorNetwork(the_map, level)
+        tables = [("corridor_edges", network.edges, self.writeEdges)]
+        if nodes:
+            tables.insert(0, ("corridor_nodes", network.nodes, self.writeNodes))
+        for table, rows, write in tables:
+            fname = tableFileName(table, level, self.extension, *parts)
+            write(level, rows(), os.path.join(output_dir, fname))
+
+    def writeTileNodes(self, level, networks, output_dir):
+        """
+        Write the corridor_nodes tables of the tiles of a level, given
+        as a list of (batch, network) pairs, once all of them are done,
+        with distances computed over the whole level.
+        """
+        print("Exporting results: level {}, corridor nodes".format(level))
+        distances = levelDistances([network for batch, network in networks])
+        for (batch, network), tile_distances in zip(networks, distances):
+            fname = tableFileName("corridor_nodes", level, self.extension, batch)
+            self.writeNodes(
+                level, network.nodes(tile_distances),
+                os.path.join(output_dir, fname))
+
+    def formatChunks(self, function, tasks):
+        """
+        Yield each of the @tasks along with the text that @function
+        formats for it, in order. Tasks are run by a pool of worker
+        processes, a few at a time so that the text held in memory stays
+        bounded, unless there is a single job or a single task.
+        """
+        jobs = self.jobs or os.cpu_count() or 1
+        tasks = iter(tasks)
+        first = list(itertools.islice(tasks, 2))
+        if jobs == 1 or len(first) < 2:
+            for task in itertools.chain(first, tasks):
+                yield task, function(task)
+            return
+
+        window = 2 * jobs
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            pending = deque()
+            for task in itertools.chain(first, tasks):
+                pending.append((task, executor.submit(function, task)))
+                if len(pending) >= window:
+                    task, future = pending.popleft()
+                    yield task, future.result()
+            while len(pending) > 0:
+                task, future = pending.popleft()
+                yield task, future.result()
+
+    def writeTable(self, table, the_map, path):
+        """
+        Write all geometries of @table to @path.
+        """
+        pass
+
+    def writeLinks(self, level, links, path):
+        """
+        Write the (drill, segment, shape, block, line) @links of a level
+        to @path.
+        """
+        pass
+
+    def writeOverlaps(self, level, overlaps, path):
+        """
+        Write the (shape, other_shape, point) @overlaps of a level to @path.
+        """
+        pass
+
+    def writeNodes(self, level, nodes, path):
+        """
+        Write the (id, point, distance) @nodes of a level to @path.
+        """
+        pass
+
+    def writeEdges(self, level, edges, path):
+        """
+        Write the (source, target, length, line) @edges of a level to @path.
+        """
+        pass
+
+    def writeRows(self, table, path, rows):
+        """
+        Write the given rows (see entities.rowGroups) of @table to @path.
+        """
+        pass
+
+
+class PostGIS(Exporter):
+    extension = "sql"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.schema = "synthetic_mine"
 
-    def write(self, level, the_map, output_dir):
+    def writeTable(self, table, the_map, path):
         """
-        Create a set of output files with instructions on how to
-        populate a PostGIS database with the generated geometries.
+        Create an output file with instructions on how to populate
+        a PostGIS table with the generated geometries.
         """
         functions = OrderedDict([
             ("mineworking", self.writeMineWorking),
@@ -24,18 +451,33 @@ class PostGIS:
             ("geological_shapes", self.writeGeologicalShapes),
             ("blockmodel", self.writeBlockModel)
         ])
-        for table in functions.keys():
-            print("Exporting results: level {}, table {}".format(level, table))
-            fname = "{}.level_{:02d}.sql".format(table, level)
-            path = os.path.join(output_dir, fname)
-            functions[table](the_map, f"{self.schema}.{table}", path)
+        if self.mineworking_format == "welded":
+            functions["mineworking"] = self.writeWeldedMineWorking
+        functions[table](the_map, f"{self.schema}.{table}", path)
+
+    def writeRows(self, table, path, rows):
+        f = self.__create(path, f"{self.schema}.{table}")
+        for i, group in enumerate(rows):
+            terminator = ",\n" if i > 0 else ""
+            row = entities.render(table, group)
+            f.write("{}('{}')".format(terminator, row))
+        f.write("\n")
+        self.__close(f"{self.schema}.{table}", f)
 
-    def __create(self, path, table):
+    def __create(self, path, table, columns=[], empty=False, types={}):
+        """
+        Open @path and start inserting rows into @table, whose layout is
+        an id, the given @columns and a geometry. Columns are integers
+        unless given another SQL type in @types. If @empty is set the
+        table is created but no rows are inserted.
+        """
         f = open(path, "w")
-        layout = "(id bigserial, geom geometry(GeometryZ))"
+        layout = "(id bigserial, {}geom geometry(GeometryZ))".format(
+            "".join("{} {}, ".format(c, types.get(c, "bigint")) for c in columns))
         f.write(f"CREATE SCHEMA IF NOT EXISTS {self.schema};\n")
         f.write(f"CREATE TABLE IF NOT EXISTS {table}{layout};\n")
-        f.write(f"INSERT INTO {table}(geom) VALUES\n")
+        if not empty:
+            f.write(f"INSERT INTO {table}({', '.join(columns + ['geom'])}) VALUES\n")
         return f
 
     def __close(self, table, f):
@@ -46,15 +488,60 @@ class PostGIS:
         f.write(f"CREATE INDEX IF NOT EXISTS {geom_idx} ON {table} USING GIST(geom);\n")
         f.close()
 
+    def writeLinks(self, level, links, path):
+        table = f"{self.schema}.segment_blocks"
+        f = self.__create(
+            path, table, ["level", "drill", "segment", "shape", "block"],
+            empty=len(links) == 0)
+        for i, (drill, segment, shape, block, line) in enumerate(links):
+            terminator = "," if i < len(links)-1 else ""
+            f.write("({}, {}, {}, {}, {}, '{}'){}\n".format(
+                level, drill, segment, shape, block, line.wkt(), terminator))
+        self.__close(table, f)
+
+    def writeOverlaps(self, level, overlaps, path):
+        table = f"{self.schema}.shape_overlaps"
+        f = self.__create(
+            path, table, ["level", "shape", "other_shape"],
+            empty=len(overlaps) == 0)
+        for i, (shape, other, point) in enumerate(overlaps):
+            terminator = "," if i < len(overlaps)-1 else ""
+            f.write("({}, {}, {}, '{}'){}\n".format(
+                level, shape, other, point.wkt(), terminator))
+        self.__close(table, f)
+
+    def writeNodes(self, level, nodes, path):
+        table = f"{self.schema}.corridor_nodes"
+        f = self.__create(
+            path, table, ["level", "node", "distance"],
+            empty=len(nodes) == 0, types={"distance": "double precision"})
+        for i, (node, point, distance) in enumerate(nodes):
+            terminator = "," if i < len(nodes)-1 else ""
+            f.write("({}, {}, {}, '{}'){}\n".format(
+                level, node, distance, point.wkt(), terminator))
+        self.__close(table, f)
+
+    def writeEdges(self, level, edges, path):
+        table = f"{self.schema}.corridor_edges"
+        f = self.__create(
+            path, table, ["level", "source", "target", "cost"],
+            empty=len(edges) == 0, types={"cost": "double precision"})
+        for i, (source, target, length, line) in enumerate(edges):
+            terminator = "," if i < len(edges)-1 else ""
+            f.write("({}, {}, {}, {}, '{}'){}\n".format(
+                level, source, target, length, line.wkt(), terminator))
+        self.__close(table, f)
+
     def writeMineWorking(self, the_map, table, path):
         """
         Write the mine working (level map).
         """
         f = self.__create(path, table)
         f.write("('POLYHEDRALSURFACEZ(\n")
-        for i, cell in enumerate(the_map.corridor):
-            terminator = "," if i < len(the_map.corridor)-1 else ""
-            f.write("{}{}\n".format(cell.coords(), terminator))
+        cell_coords = the_map.wallMesh().cellCoords()
+        for i, coords in enumerate(cell_coords):
+            terminator = "," if i < len(cell_coords)-1 else ""
+            f.write("{}{}\n".format(coords, terminator))
         f.write(")')")
         if the_map.elevator is not None:
             f.write(",\n")
@@ -63,6 +550,14 @@ class PostGIS:
             f.write(")')")
         self.__close(table, f)
 
+    def writeWeldedMineWorking(self, the_map, table, path):
+        """
+        Write the mine working (level map) as a single welded surface.
+        """
+        f = self.__create(path, table)
+        f.write("('{}')\n".format(IndexedMesh.fromMap(the_map).wkt()))
+        self.__close(table, f)
+
     def writeDrillHoles(self, the_map, table, path):
         """
         Write drill holes as a series of LineString objects.
@@ -93,12 +588,9 @@ class PostGIS:
         Write drill hole segments.
         """
         f = self.__create(path, table)
-        for i, drill in enumerate(the_map.drills):
-            segments = drill.segments()
-            for j, segment in enumerate(segments):
-                last = i == len(the_map.drills)-1 and j == len(segments)-1
-                terminator = "," if not last else ""
-                f.write("('{}'){}\n".format(segment.geom(), terminator))
+        tasks = segmentTasks(the_map.drills, True)
+        for task, text in self.formatChunks(formatSegments, tasks):
+            f.write(text)
         self.__close(table, f)
 
     def writePoints(self, the_map, table, path):
@@ -127,16 +619,24 @@ class PostGIS:
         Write block model entities.
         """
         f = self.__create(path, table)
-        for i, shape in enumerate(the_map.shapes):
-            terminator = "," if i < len(the_map.shapes)-1 else ""
-            f.write("{}{}\n".format(shape.blockmodelGeom(), terminator))
+        i = 0
+        tasks = blockTasks(the_map, True)
+        for (model, postgis_output, last), text in self.formatChunks(formatBlocks, tasks):
+            f.write(text)
+            if last:
+                terminator = "," if i < len(the_map.shapes)-1 else ""
+                f.write("{}\n".format(terminator))
+                i += 1
         self.__close(table, f)
 
 
-class WKT:
-    def write(self, level, the_map, output_dir):
+
+class WKT(Exporter):
+    extension = "wkt"
+
+    def writeTable(self, table, the_map, path):
         """
-        Create a set of output files in plain WKT format.
+        Create an output file in plain WKT format.
         """
         functions = OrderedDict([
             ("mineworking", self.writeMineWorking),
@@ -147,26 +647,76 @@ class WKT:
             ("geological_shapes", self.writeGeologicalShapes),
             ("blockmodel", self.writeBlockModel)
         ])
-        for table in functions.keys():
-            print("Exporting results: level {}, {}".format(level, table))
-            fname = "{}.level_{:02d}.wkt".format(table, level)
-            with open(os.path.join(output_dir, fname), "w") as f:
-                functions[table](the_map, f)
+        if self.mineworking_format == "welded":
+            functions["mineworking"] = self.writeWeldedMineWorking
+        with open(path, "w") as f:
+            functions[table](the_map, f)
+
+    def writeRows(self, table, path, rows):
+        with open(path, "w") as f:
+            for group in rows:
+                f.write("{}\n".format(entities.render(table, group)))
+
+    def writeLinks(self, level, links, path):
+        """
+        Write one tab-separated line per link, with the level, the drill
+        hole, the segment, the shape, the block and the WKT of the piece
+        of the segment.
+        """
+        with open(path, "w") as f:
+            for drill, segment, shape, block, line in links:
+                f.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(
+                    level, drill, segment, shape, block, line.wkt()))
+
+    def writeOverlaps(self, level, overlaps, path):
+        """
+        Write one tab-separated line per overlap, with the level, both
+        shapes and the WKT of the point deepest within both of them.
+        """
+        with open(path, "w") as f:
+            for shape, other, point in overlaps:
+                f.write("{}\t{}\t{}\t{}\n".format(level, shape, other, point.wkt()))
+
+    def writeNodes(self, level, nodes, path):
+        """
+        Write one tab-separated line per node, with the level, the node
+        id, its distance from the elevator and its WKT point.
+        """
+        with open(path, "w") as f:
+            for node, point, distance in nodes:
+                f.write("{}\t{}\t{}\t{}\n".format(level, node, distance, point.wkt()))
+
+    def writeEdges(self, level, edges, path):
+        """
+        Write one tab-separated line per edge, with the level, the source
+        and target node ids, the length and the WKT of the edge.
+        """
+        with open(path, "w") as f:
+            for source, target, length, line in edges:
+                f.write("{}\t{}\t{}\t{}\t{}\n".format(
+                    level, source, target, length, line.wkt()))
 
     def writeMineWorking(self, the_map, f):
         """
         Write the mine working (level map).
         """
         f.write("POLYHEDRALSURFACEZ(")
-        for i, cell in enumerate(the_map.corridor):
-            terminator = "," if i < len(the_map.corridor)-1 else ""
-            f.write("{}{}".format(cell.coords(), terminator))
+        cell_coords = the_map.wallMesh().cellCoords()
+        for i, coords in enumerate(cell_coords):
+            terminator = "," if i < len(cell_coords)-1 else ""
+            f.write("{}{}".format(coords, terminator))
         f.write(")\n")
         if the_map.elevator is not None:
             f.write("POLYHEDRALSURFACEZ(")
             f.write("{}".format(the_map.elevator.coords()))
             f.write(")\n")
 
+    def writeWeldedMineWorking(self, the_map, f):
+        """
+        Write the mine working (level map) as a single welded surface.
+        """
+        f.write("{}\n".format(IndexedMesh.fromMap(the_map).wkt()))
+
     def writeDrillHoles(self, the_map, f):
         """
         Write drill holes as a series of LineString objects.
@@ -191,9 +741,9 @@ class WKT:
         """
         Write drill hole segments.
         """
-        for i, drill in enumerate(the_map.drills):
-            for j, segment in enumerate(drill.segments()):
-                f.write("{}\n".format(segment.geom()))
+        tasks = segmentTasks(the_map.drills, False)
+        for task, text in self.formatChunks(formatSegments, tasks):
+            f.write(text)
 
     def writePoints(self, the_map, f):
         """
@@ -214,5 +764,8 @@ class WKT:
         """
         Write block model entities.
         """
-        for i, shape in enumerate(the_map.shapes):
-            f.write("{}\n".format(shape.blockmodelGeom(postgis_output=False)))
+        tasks = blockTasks(the_map, False)
+        for (model, postgis_output, last), text in self.formatChunks(formatBlocks, tasks):
+            f.write(text)
+            if last:
+                f.write("\n")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Overlaps between geological shapes. Shapes grow around random drill hole
+# ends and often run into each other. The bounding boxes of their convex
+# hulls are arranged in a bounding volume hierarchy, so that only the hulls
+# whose boxes overlap are compared, and each of those pairs is then tested
+# exactly by looking for the point that lies deepest within both hulls.
+
+from scipy.optimize import linprog
+from scipy.spatial import ConvexHull
+import numpy as np
+
+# Largest number of hulls held by a leaf of the hierarchy
+LEAF_SIZE = 4
+
+class HullBVH:
+    """
+    Bounding volume hierarchy over the convex hulls of the given list of
+    (N,3) @hulls (e.g., GeologicalShape.points). Nodes are kept in flat
+    arrays, and hulls are identified by their position in @hulls.
+    """
+    def __init__(self, hulls):
+        self.hulls = list(hulls)
+        self.equations = [None] * len(self.hulls)
+        self.bboxes = np.array([
+            np.concatenate([np.min(h, axis=0), np.max(h, axis=0)])
+            for h in self.hulls], dtype=np.float64).reshape(-1, 6)
+        self.order = np.arange(len(self.bboxes))
+
+        # Each node covers order[start:end], and is split at the median of
+        # the centers of its boxes along their longest axis
+        boxes, starts, ends, children = [], [], [], []
+        stack = [(0, len(self.bboxes), None)] if len(self.bboxes) else []
+        while len(stack) > 0:
+            start, end, parent = stack.pop()
+            node = len(boxes)
+            if parent is not None:
+                children[parent].append(node)
+            ids = self.order[start:end]
+            box = self.bboxes[ids]
+            boxes.append(np.concatenate([box[:, 0:3].min(axis=0), box[:, 3:6].max(axis=0)]))
+            starts.append(start)
+            ends.append(end)
+            children.append([])
+            if end - start <= LEAF_SIZE:
+                continue
+            centers = (box[:, 0:3] + box[:, 3:6]) / 2
+            axis = np.argmax(centers.max(axis=0) - centers.min(axis=0))
+            middle = (end - start) // 2
+            split = np.argpartition(centers[:, axis], middle)
+            self.order[start:end] = ids[split]
+            stack.append((start + middle, end, node))
+            stack.append((start, start + middle, node))
+
+        self.node_boxes = np.array(boxes, dtype=np.float64).reshape(-1, 6)
+        self.node_starts = np.array(starts, dtype=np.int64)
+        self.node_ends = np.array(ends, dtype=np.int64)
+        self.node_children = [tuple(c) for c in children]
+
+    def __len__(self):
+        return len(self.hulls)
+
+    def query(self, bbox):
+        """
+        Return the ids of the hulls whose boxes overlap the given
+        (xmin, ymin, zmin, xmax, ymax, zmax) @bbox.
+        """
+        bbox = np.asarray(bbox, dtype=np.float64)
+        found = []
+        stack = [0] if len(self.node_boxes) else []
+        while len(stack) > 0:
+            node = stack.pop()
+            if not boxesOverlap(self.node_boxes[node], bbox):
+                continue
+            if len(self.node_children[node]) == 0:
+                ids = self.order[self.node_starts[node]:self.node_ends[node]]
+                hit = boxesOverlap(self.bboxes[ids], bbox)
+                found.append(ids[hit])
+            else:
+                stack.extend(self.node_children[node])
+        if len(found) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(found))
+
+    def candidates(self):
+        """
+        Return the (i, j) pairs of hulls whose boxes overlap, with i < j.
+        The hierarchy is walked against itself, so that subtrees whose
+        boxes are apart are never compared.
+        """
+        pairs = []
+        stack = [(0, 0)] if len(self.node_boxes) else []
+        while len(stack) > 0:
+            a, b = stack.pop()
+            if not boxesOverlap(self.node_boxes[a], self.node_boxes[b]):
+                continue
+            children_a, children_b = self.node_children[a], self.node_children[b]
+            if a == b and len(children_a) > 0:
+                # Pairs within each child, and across the children
+                stack.extend((c, c) for c in children_a)
+                stack.append((children_a[0], children_a[1]))
+            elif len(children_a) == 0 and len(children_b) == 0:
+                ids_a = self.order[self.node_starts[a]:self.node_ends[a]]
+                ids_b = self.order[self.node_starts[b]:self.node_ends[b]]
+                hit = boxesOverlap(
+                    self.bboxes[ids_a][:, None, :], self.bboxes[ids_b][None, :, :])
+                i, j = np.nonzero(hit)
+                i, j = ids_a[i], ids_b[j]
+                if a == b:
+                    i, j = i[i < j], j[i < j]
+                else:
+                    i, j = np.minimum(i, j), np.maximum(i, j)
+                pairs.extend(zip(i.tolist(), j.tolist()))
+            elif len(children_b) == 0 or (len(children_a) > 0 and \
+                    self.node_ends[a] - self.node_starts[a] >= \
+                    self.node_ends[b] - self.node_starts[b]):
+                stack.extend((c, b) for c in children_a)
+            else:
+                stack.extend((a, c) for c in children_b)
+        return sorted(pairs)
+
+    def hullEquations(self, n):
+        """
+        Half-space equations of the n-th hull, computed once.
+        """
+        if self.equations[n] is None:
+            self.equations[n] = ConvexHull(self.hulls[n]).equations
+        return self.equations[n]
+
+    def overlaps(self, eps=1e-9):
+        """
+        Return the pairs of hulls that overlap, as in candidates(), as a
+        list of (i, j, center) tuples, where center is the (3,) point
+        that lies deepest within both hulls. Hulls that merely touch are
+        left out.
+        """
+        found = []
+        for i, j in self.candidates():
+            depth, center = overlapDepth(
+                self.hullEquations(i), self.hullEquations(j))
+            if depth > eps:
+                found.append((i, j, center))
+        return found
+
+
+def boxesOverlap(a, b):
+    """
+    Tell whether the (..., 6) boxes @a and @b overlap, broadcasting over
+    their leading dimensions.
+    """
+    return np.all(
+        (a[..., 0:3] <= b[..., 3:6]) & (a[..., 3:6] >= b[..., 0:3]), axis=-1)
+
+
+def overlapDepth(eq_a, eq_b):
+    """
+    Return the radius of the largest ball that fits within both convex
+    hulls given by their half-space equations @eq_a and @eq_b (negative
+    if the hulls are apart), along with its center. The ball is found by
+    linear programming, as the equations of scipy's hulls hold unit
+    normals.
+    """
+    equations = np.concatenate([eq_a, eq_b])
+    a_ub = np.concatenate([equations[:, 0:3], np.ones((len(equations), 1))], axis=1)
+    result = linprog(
+        [0, 0, 0, -1], A_ub=a_ub, b_ub=-equations[:, 3],
+        bounds=[(None, None)] * 4, method="highs")
+    if result.status != 0:
+        return -np.inf, None
+    return result.x[3], result.x[0:3]
+
+
+def shapeOverlaps(shapes):
+    """
+    Find the pairs of geological @shapes whose convex hulls overlap.
+    Returns a list of (i, j, center) tuples as in HullBVH.overlaps(),
+    where i < j are positions in @shapes.
+    """
+    return HullBVH([shape.points for shape in shapes]).overlaps()
+
+
+def rejectOverlaps(shapes):
+    """
+    Return the positions of the @shapes to keep so that no two of them
+    overlap. Shapes are kept in order, and dropped if they overlap one
+    of the shapes kept before them.
+    """
+    overlapping = {}
+    for i, j, center in shapeOverlaps(shapes):
+        overlapping.setdefault(j, []).append(i)
+    kept = set()
+    for n in range(len(shapes)):
+        if not any(i in kept for i in overlapping.get(n, [])):
+            kept.add(n)
+    return sorted(kept)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Spatial partitioning of the exported entities. Entities are assigned
+# to XY tiles or to octree cells and sorted along a Z-order (Morton)
+# curve so that each output file has good spatial locality.
+
+from collections import OrderedDict
+from src.entities import collect, boundingBoxes, rowGroups, extent
+import numpy as np
+
+# Number of bits used to quantize each axis when computing Morton codes
+CURVE_BITS = 21
+
+def spreadBits(values):
+    """
+    Interleave two zero bits between each of the lower 21 bits of
+    @values, an array of unsigned integers.
+    """
+    v = values.astype(np.uint64) & np.uint64(0x1fffff)
+    v = (v | v << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    v = (v | v << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    v = (v | v << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+    v = (v | v << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+    v = (v | v << np.uint64(2)) & np.uint64(0x1249249249249249)
+    return v
+
+def mortonCode(ix, iy, iz):
+    """
+    Compute the 3D Morton code of the given integer coordinate arrays.
+    """
+    return spreadBits(ix) | \
+        (spreadBits(iy) << np.uint64(1)) | \
+        (spreadBits(iz) << np.uint64(2))
+
+
+class Partitioner:
+    """
+    Assign entities to spatial partitions.
+    """
+    TILES  = "tiles"
+    OCTREE = "octree"
+
+    def __init__(self, mode, tile_size=100.0, depth=3):
+        if mode not in [self.TILES, self.OCTREE]:
+            raise ValueError("invalid partitioning mode '{}'".format(mode))
+        if depth < 1 or depth > CURVE_BITS:
+            raise ValueError("octree depth must be within 1 and {}".format(
+                CURVE_BITS))
+        self.mode = mode
+        self.tile_size = float(tile_size)
+        self.depth = depth
+
+    def quantize(self, centers, extent):
+        """
+        Map @centers onto the integer grid used by the Z-order curve
+        that spans @extent.
+        """
+        lower = extent[0:3]
+        span = np.maximum(extent[3:6] - lower, 1e-9)
+        scale = (1 << CURVE_BITS) - 1
+        q = np.floor((centers - lower) / span * scale)
+        return np.clip(q, 0, scale).astype(np.uint64)
+
+    def assign(self, bboxes, extent):
+        """
+        Return the partition name of each bounding box in @bboxes along
+        with its position on the Z-order curve that spans @extent.
+        """
+        centers = (bboxes[:, 0:3] + bboxes[:, 3:6]) / 2.0
+        q = self.quantize(centers, extent)
+        keys = mortonCode(q[:, 0], q[:, 1], q[:, 2])
+
+        if self.mode == self.TILES:
+            tiles = np.floor(centers[:, 0:2] / self.tile_size).astype(np.int64)
+            names = ["tile_{}_{}".format(tx, ty) for tx, ty in tiles.tolist()]
+        else:
+            # The octal digits of the leading bits of the Morton code
+            # give the path from the root of the octree to the cell
+            cells = keys >> np.uint64(3 * (CURVE_BITS - self.depth))
+            names = ["octree_{:0{}o}".format(c, self.depth) for c in cells.tolist()]
+        return names, keys
+
+    def split(self, the_map, tables):
+        """
+        Partition the entities of each of @tables. Yields tuples with
+        the table name, the partition name, and the rows to write (see
+        entities.rowGroups), sorted along the Z-order curve.
+        """
+        entities = OrderedDict()
+        bboxes = OrderedDict()
+        for table in tables:
+            entities[table] = collect(the_map, table)
+            bboxes[table] = boundingBoxes(entities[table])
+
+        # All tables of a level share the same curve (and octree)
+        all_bboxes = np.concatenate(list(bboxes.values()))
+        if len(all_bboxes) == 0:
+            return
+        level_extent = extent(all_bboxes)
+
+        for table in tables:
+            if len(entities[table]) == 0:
+                continue
+            names, keys = self.assign(bboxes[table], level_extent)
+            groups = OrderedDict()
+            for idx in np.argsort(keys, kind="stable").tolist():
+                groups.setdefault(names[idx], []).append(entities[table][idx])
+            for name in sorted(groups.keys()):
+                yield table, name, rowGroups(table, groups[name], the_map.elevator)
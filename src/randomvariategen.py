@@ -56,14 +56,16 @@ class TheoreticalDistribution(RandomVariateGenerator):
         self.name = name
         self.params = params
 
-    def generate(self, nsamples=1):
+    def generate(self, nsamples=1, random_state=None):
         """
-        Generate n samples from theoretical distributions
+        Generate n samples from theoretical distributions, drawn from
+        @random_state (a numpy.random.RandomState) if given, or from
+        NumPy's global generator otherwise
         """
         # Obtain the random variate object
         dist = getattr(stats, self.name)
         # Generate the random variate
-        return dist.rvs(* self.params, size=nsamples)
+        return dist.rvs(* self.params, size=nsamples, random_state=random_state)
 
 class EmpiricalDistribution(RandomVariateGenerator):
     """
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# In-process access to generated mines. Rather than writing files, the
+# rows of each table are handed out as records that expose their geometry
+# as NumPy arrays, WKB or WKT (the same text the exporters write), along
+# with their bounding box. Records are produced lazily, one level at a
+# time (see MineGenerator.records()).
+
+from src import entities
+from src.output import TABLES
+import numpy as np
+import struct
+
+# ISO WKB geometry types, Z variants
+WKB_POINTZ = 1001
+WKB_LINESTRINGZ = 1002
+WKB_POLYGONZ = 1003
+WKB_MULTILINESTRINGZ = 1005
+WKB_POLYHEDRALSURFACEZ = 1015
+
+# Geometry type of the rows of each table
+TABLE_TYPES = {
+    "mineworking": WKB_POLYHEDRALSURFACEZ,
+    "drillholes": WKB_LINESTRINGZ,
+    "multiline_drillholes": WKB_MULTILINESTRINGZ,
+    "segments": WKB_LINESTRINGZ,
+    "points": WKB_POINTZ,
+    "geological_shapes": WKB_POLYHEDRALSURFACEZ,
+    "blockmodel": WKB_POLYHEDRALSURFACEZ
+}
+
+def encodeWKB(geometry_type, array):
+    """
+    Little-endian WKB encoding of a geometry of @geometry_type whose
+    coordinates are given in @array, shaped as in Entity.array().
+    """
+    array = np.ascontiguousarray(array, dtype="<f8")
+    if geometry_type == WKB_POINTZ:
+        return struct.pack("<BI", 1, geometry_type) + array.tobytes()
+    elif geometry_type == WKB_LINESTRINGZ:
+        return struct.pack("<BII", 1, geometry_type, len(array)) + array.tobytes()
+    elif geometry_type == WKB_MULTILINESTRINGZ:
+        return struct.pack("<BII", 1, geometry_type, len(array)) + b"".join(
+            encodeWKB(WKB_LINESTRINGZ, line) for line in array)
+    elif geometry_type == WKB_POLYHEDRALSURFACEZ:
+        # Each face is a polygon with a single, closed, ring
+        rings = np.concatenate([array, array[:, 0:1, :]], axis=1)
+        header = struct.pack("<BIII", 1, WKB_POLYGONZ, 1, rings.shape[1])
+        return struct.pack("<BII", 1, geometry_type, len(rings)) + b"".join(
+            header + ring.tobytes() for ring in rings)
+    raise ValueError("unsupported geometry type {}".format(geometry_type))
+
+
+class Record:
+    """
+    A row of @table of @level, made of the entities in @group (see
+    entities.rowGroups). @index is the position of the row within the
+    table of its level, in the order used by the exporters.
+    """
+    __slots__ = ["level", "table", "index", "group"]
+
+    def __init__(self, level, table, index, group):
+        self.level = level
+        self.table = table
+        self.index = index
+        self.group = group
+
+    def __repr__(self):
+        return "Record(level={}, table='{}', index={})".format(
+            self.level, self.table, self.index)
+
+    def bbox(self):
+        """
+        Bounding box of the row as a tuple
+        (xmin, ymin, zmin, xmax, ymax, zmax).
+        """
+        return tuple(entities.groupBoundingBoxes([self.group])[0].tolist())
+
+    def array(self):
+        """
+        Coordinates of the row as a NumPy array (see entities.renderArray).
+        """
+        return entities.renderArray(self.table, self.group)
+
+    def wkb(self):
+        """
+        WKB representation of the row.
+        """
+        return encodeWKB(TABLE_TYPES[self.table], self.array())
+
+    def wkt(self):
+        """
+        WKT representation of the row, as in partitioned output files.
+        """
+        return entities.render(self.table, self.group)
+
+
+def levelRecords(level, the_map, tables=TABLES):
+    """
+    Yield the records of the given @tables of a level, table by table.
+    """
+    for table in tables:
+        groups = entities.rowGroups(
+            table,
+            entities.collect(the_map, table),
+            the_map.elevator)
+        for index, group in enumerate(groups):
+            yield Record(level, table, index, group)
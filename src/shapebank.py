@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Bank of precomputed geological shapes. Shapes are statistically
+# interchangeable, so a bank of templates grown once from the configured
+# size distributions can stand in for most of the shapes of a mine: each
+# placement costs a lookup plus a translation and a quarter turn.
+
+from src.geometry import Point
+from src.objects import GeologicalShape
+import concurrent.futures
+import numpy as np
+import random
+import math
+import os
+
+class ShapeBank:
+    """
+    Collection of geological shapes grown at the origin, used as
+    templates by place().
+    """
+    def __init__(self, shapes, key=None):
+        self.shapes = shapes
+        self.key = key
+
+    @classmethod
+    def build(cls, size, shape_size_generators, seed, key=None):
+        """
+        Grow @size template shapes with the given size generators. Sizes
+        and the growth of each shape are drawn from generators of their
+        own seeded with @seed, so the global ones are left untouched.
+        """
+        rng = random.Random(seed)
+        random_state = np.random.RandomState(seed % (1 << 32))
+        sizes = [
+            [math.ceil(gen.generate(1, random_state)[0])
+             for gen in shape_size_generators]
+            for n in range(size)]
+        rngs = [random.Random(rng.getrandbits(64)) for n in range(size)]
+
+        def grow(sizes, rng):
+            xsize, ysize, zsize = sizes
+            shape = GeologicalShape(
+                xsize, ysize, zsize, xsize * ysize * zsize, rng)
+            shape.create(Point(0, 0, 0))
+            return shape
+
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            shapes = list(executor.map(grow, sizes, rngs))
+        return cls(shapes, key)
+
+    @classmethod
+    def open(cls, path, size, shape_size_generators, key, seed):
+        """
+        Load the bank stored at @path, or build it from @seed and store
+        it there if it does not exist or was built for a different @key
+        (a digest of the settings and code the bank depends on).
+        """
+        if os.path.exists(path):
+            bank = cls.load(path)
+            if bank.key == key:
+                return bank
+        print("Building shape bank: {} shapes".format(size))
+        bank = cls.build(size, shape_size_generators, seed, key)
+        bank.save(path)
+        return bank
+
+    def save(self, path):
+        """
+        Write the bank to @path in NumPy's .npz format.
+        """
+        def offsets(arrays):
+            return np.cumsum([0] + [len(a) for a in arrays], dtype=np.int64)
+
+        blocks = [
+            np.array(s.block_indexes, dtype=np.int64).reshape(-1, 3)
+            for s in self.shapes]
+        points = [s.points for s in self.shapes]
+        simplices = [s.simplices.astype(np.int64) for s in self.shapes]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                key=np.array(self.key or ""),
+                sizes=np.array(
+                    [[s.xsize, s.ysize, s.zsize, s.max_blocks]
+                     for s in self.shapes], dtype=np.int64).reshape(-1, 4),
+                seeds=np.array(
+                    [[s.seed.x, s.seed.y, s.seed.z] for s in self.shapes],
+                    dtype=np.float64).reshape(-1, 3),
+                block_offsets=offsets(blocks),
+                blocks=np.concatenate(blocks),
+                point_offsets=offsets(points),
+                points=np.concatenate(points),
+                simplex_offsets=offsets(simplices),
+                simplices=np.concatenate(simplices))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a bank previously written by save().
+        """
+        data = np.load(path)
+        blocks = data["blocks"]
+        points = data["points"]
+        simplices = data["simplices"]
+        bo, po, so = [
+            data[name].tolist()
+            for name in ["block_offsets", "point_offsets", "simplex_offsets"]]
+        shapes = []
+        for n, ((xsize, ysize, zsize, max_blocks), seed) in enumerate(
+                zip(data["sizes"].tolist(), data["seeds"].tolist())):
+            shape = GeologicalShape(xsize, ysize, zsize, max_blocks)
+            shape.seed = Point(*seed)
+            shape.block_indexes = blocks[bo[n]:bo[n+1]].astype(np.int64)
+            shape.points = points[po[n]:po[n+1]]
+            shape.simplices = simplices[so[n]:so[n+1]]
+            shapes.append(shape)
+        return cls(shapes, str(data["key"]))
+
+    def place(self, seed, rng):
+        """
+        Create a shape grown from @seed out of a random template, turned
+        around the vertical axis by a random number of quarter turns.
+        """
+        template = self.shapes[rng.randrange(len(self.shapes))]
+        return GeologicalShape.fromTemplate(template, seed, rng.randrange(4))
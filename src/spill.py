@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Spilling of finished level objects to disk. Drill holes and geological
+# shapes stay in a MapGen until the level is exported. With a memory
+# budget, those that do not fit in it are written to scratch files and
+# read back through read-only memory maps, whose pages the OS can drop at
+# will, so exporters stream them from disk as they write each row.
+
+from collections import OrderedDict
+from collections.abc import Sequence
+from src.geometry import Point
+from src.objects import DrillHole
+import numpy as np
+import threading
+import tempfile
+import shutil
+import os
+
+# Number of drill holes kept or spilled together
+DRILL_BATCH = 4096
+
+# Approximate resident size of the objects of a level: a corridor cell
+# (walls included), a drill hole (line, points and normal) and a block
+# index kept as a tuple. Shapes add their arrays, counting the copies held
+# by the convex hull and the triangulation.
+CELL_BYTES = 1700
+DRILL_BYTES = 800
+BLOCK_BYTES = 120
+
+
+def shapeBytes(shape):
+    """
+    Approximate resident size of a geological shape.
+    """
+    blocks = shape.block_indexes
+    if isinstance(blocks, np.ndarray):
+        size = blocks.nbytes
+    else:
+        size = len(blocks) * BLOCK_BYTES
+    if shape.map is not None:
+        size += shape.map.nbytes
+    if shape.points is not None:
+        size += shape.points.nbytes * (1 + (shape.hull is not None))
+    if shape.simplices is not None:
+        size += shape.simplices.nbytes * (1 + 4 * (shape.delaunay is not None))
+    if shape.triangles is not None:
+        size += shape.triangles.nbytes
+    return size
+
+
+class SpillArea:
+    """
+    Memory budget of a level, of @max_memory bytes. Objects that do not
+    fit in it are written to a scratch directory created in @directory
+    (the system's temporary directory by default). Resident and spilled
+    sizes are tracked per generation stage (see MapGen.STAGES).
+    """
+    def __init__(self, max_memory, directory=None):
+        self.max_memory = max_memory
+        self.directory = directory
+        self.scratch = None
+        self.resident = OrderedDict()
+        self.spilled = OrderedDict()
+        self.files = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Worker processes start with a budget and scratch files of their own
+        state = self.__dict__.copy()
+        del state["lock"]
+        state["scratch"] = None
+        state["resident"] = OrderedDict()
+        state["spilled"] = OrderedDict()
+        state["files"] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def track(self, stage, nbytes):
+        """
+        Account for @nbytes that stay resident, whatever the budget.
+        """
+        with self.lock:
+            self.resident[stage] = self.resident.get(stage, 0) + nbytes
+
+    def reserve(self, stage, nbytes):
+        """
+        Tell whether @nbytes more fit in the budget, accounting for them
+        as resident if so and as spilled otherwise.
+        """
+        with self.lock:
+            fits = sum(self.resident.values()) + nbytes <= self.max_memory
+            sizes = self.resident if fits else self.spilled
+            sizes[stage] = sizes.get(stage, 0) + nbytes
+        return fits
+
+    def save(self, array):
+        """
+        Write @array to a scratch file and return a read-only memory
+        map of it.
+        """
+        with self.lock:
+            if self.scratch is None:
+                if self.directory is not None:
+                    os.makedirs(self.directory, exist_ok=True)
+                self.scratch = tempfile.mkdtemp(prefix="spill-", dir=self.directory)
+            path = os.path.join(self.scratch, "{:06d}.npy".format(self.files))
+            self.files += 1
+        np.save(path, np.ascontiguousarray(array))
+        return np.load(path, mmap_mode="r")
+
+    def shape(self, shape):
+        """
+        Keep a finished geological shape within the budget, spilling its
+        dense map, hull points, triangulation, refined surface and block
+        indexes if it does not fit. The convex hull and triangulation
+        objects are dropped. Returns @shape.
+        """
+        if self.reserve("shapes", shapeBytes(shape)):
+            return shape
+        if shape.map is not None:
+            shape.map = self.save(shape.map)
+        shape.points = self.save(shape.points)
+        shape.simplices = self.save(shape.simplices)
+        if shape.triangles is not None:
+            shape.triangles = self.save(shape.triangles)
+        shape.block_indexes = BlockIndexes(self.save(
+            np.array(shape.block_indexes, dtype=np.int64).reshape(-1, 3)))
+        shape.hull = None
+        shape.delaunay = None
+        return shape
+
+    def drills(self, drills=()):
+        """
+        Return a list of drill holes kept within the budget, holding
+        the given @drills.
+        """
+        return DrillList(self, drills)
+
+    def report(self):
+        """
+        Summary of the resident and spilled size of each stage.
+        """
+        stages = []
+        for stage in list(self.resident) + [
+                s for s in self.spilled if s not in self.resident]:
+            text = "{} {:.1f} MB".format(stage, self.resident.get(stage, 0) / 1e6)
+            if stage in self.spilled:
+                text += " ({:.1f} MB spilled)".format(self.spilled[stage] / 1e6)
+            stages.append(text)
+        return "Memory: {}".format(", ".join(stages))
+
+    def release(self):
+        """
+        Remove the scratch files and reset the budget, once the objects
+        of a level are no longer needed.
+        """
+        if self.scratch is not None:
+            shutil.rmtree(self.scratch, ignore_errors=True)
+            self.scratch = None
+        self.resident.clear()
+        self.spilled.clear()
+        self.files = 0
+
+
+class BlockIndexes(Sequence):
+    """
+    The (i, j, k) block indexes of a spilled shape, read from the (N,3)
+    @array they were spilled to.
+    """
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, n):
+        return tuple(self.array[n].tolist())
+
+    def __iter__(self):
+        for start in range(0, len(self.array), DRILL_BATCH):
+            yield from map(tuple, self.array[start:start+DRILL_BATCH].tolist())
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.array, dtype=dtype)
+
+    def __reduce__(self):
+        # Saved states hold the blocks themselves, not the scratch file
+        return (list, (list(self),))
+
+
+class DrillList(Sequence):
+    """
+    Drill holes of a level, in batches of DRILL_BATCH. Batches that do
+    not fit in the budget of @spill are written to scratch arrays, and
+    their drill holes are created again whenever they are read.
+    """
+    def __init__(self, spill, drills=()):
+        self.spill = spill
+        self.batches = []
+        self.pending = []
+        for drill in drills:
+            self.append(drill)
+
+    def append(self, drill):
+        self.pending.append(drill)
+        if len(self.pending) == DRILL_BATCH:
+            self.flush()
+
+    def flush(self):
+        """
+        Keep or spill the drill holes appended since the last batch.
+        """
+        if len(self.pending) == 0:
+            return
+        batch = self.pending
+        self.pending = []
+        if not self.spill.reserve("drillholes", len(batch) * DRILL_BYTES):
+            # One row per drill hole: collar, end point, normal, length,
+            # interval length, column and row
+            batch = self.spill.save(np.array([
+                [d.line.p1.x, d.line.p1.y, d.line.p1.z,
+                 d.line.p2.x, d.line.p2.y, d.line.p2.z,
+                 d.normal.x, d.normal.y, d.normal.z,
+                 d.length, d.segment_size, d.col, d.row]
+                for d in batch], dtype=np.float64))
+        self.batches.append(batch)
+
+    def __len__(self):
+        return sum(len(b) for b in self.batches) + len(self.pending)
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        for batch in self.batches + [self.pending]:
+            if 0 <= n < len(batch):
+                if isinstance(batch, list):
+                    return batch[n]
+                return self.__drill(batch[n].tolist())
+            n -= len(batch)
+        raise IndexError("drill hole index out of range")
+
+    def __iter__(self):
+        for batch in self.batches + [self.pending]:
+            if isinstance(batch, list):
+                yield from batch
+            else:
+                yield from map(self.__drill, batch.tolist())
+
+    def __reduce__(self):
+        # Saved states hold the drill holes themselves
+        return (list, (list(self),))
+
+    def __drill(self, values):
+        x1, y1, z1, x2, y2, z2, nx, ny, nz, length, segment_size, col, row = values
+        drill = DrillHole(
+            Point(x1, y1, z1), Point(nx, ny, nz), int(col), int(row), None,
+            int(segment_size) if segment_size.is_integer() else segment_size)
+        drill.line.p2 = Point(x2, y2, z2)
+        drill.length = length
+        return drill
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tiled levels. A level far larger than a single grid is split into tiles
+# of grid_cols x grid_rows cells, each one generated and exported on its
+# own. Tiles are stitched together by gates: endpoints on both sides of a
+# shared border, at a position that both tiles derive from the seed alone,
+# whose corridors open onto each other. Tiles therefore never need to see
+# each other's cells, and can be created in any order or in parallel.
+
+import random
+
+class Tiling:
+    """
+    Split of a level into @tiles = (tile_cols, tile_rows) tiles of
+    @cols x @rows cells each. Tiles are identified by their (tx, ty)
+    position, and cells by their (col, row) position in the level.
+    """
+    def __init__(self, tiles, cols, rows):
+        self.tile_cols, self.tile_rows = tiles
+        self.cols = cols
+        self.rows = rows
+
+    def __len__(self):
+        return self.tile_cols * self.tile_rows
+
+    def __iter__(self):
+        for ty in range(self.tile_rows):
+            for tx in range(self.tile_cols):
+                yield (tx, ty)
+
+    def name(self, tile):
+        """
+        Name of the files of @tile (see output.tableFileName).
+        """
+        return "tile_{:03d}_{:03d}".format(*tile)
+
+    def origin(self, tile):
+        """
+        Position in the level of the first cell of @tile.
+        """
+        tx, ty = tile
+        return (tx * self.cols, ty * self.rows)
+
+    def local(self, coords, tile):
+        """
+        Position within @tile of the cell at @coords of the level, or
+        None if the cell belongs to another tile.
+        """
+        col0, row0 = self.origin(tile)
+        col, row = coords[0] - col0, coords[1] - row0
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return (col, row)
+        return None
+
+    def gates(self, tile, seed):
+        """
+        Gates of @tile, as a list of ((col, row), (outside_col,
+        outside_row)) pairs: a cell on the border of the tile and its
+        neighbor across the border, both relative to the tile. Each
+        border has a single gate, at a position drawn from @seed.
+        """
+        def position(axis, tx, ty, size):
+            rng = random.Random("{}:{}:{}:{}".format(seed, axis, tx, ty))
+            return rng.randrange(size)
+
+        tx, ty = tile
+        gates = []
+        if tx > 0:
+            row = position("x", tx-1, ty, self.rows)
+            gates.append(((0, row), (-1, row)))
+        if tx < self.tile_cols - 1:
+            row = position("x", tx, ty, self.rows)
+            gates.append(((self.cols-1, row), (self.cols, row)))
+        if ty > 0:
+            col = position("y", tx, ty-1, self.cols)
+            gates.append(((col, 0), (col, -1)))
+        if ty < self.tile_rows - 1:
+            col = position("y", tx, ty, self.cols)
+            gates.append(((col, self.rows-1), (col, self.rows)))
+        return gates
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Voxel hashing of axis-aligned boxes. Boxes are registered in every cell
+# of a uniform grid they overlap, and segments are walked through the grid
+# one cell at a time (3D DDA), so finding the boxes crossed by a segment
+# costs time proportional to its length rather than to the number of boxes.
+# Line segments can be hashed too, to find those that lie close to another.
+
+from src import entities
+from src.blockmodel import BlockModel
+import numpy as np
+import math
+
+class VoxelIndex:
+    """
+    Hash of the (N,6) @bboxes (xmin, ymin, zmin, xmax, ymax, zmax) into
+    cubic voxels of @voxel_size. Boxes are identified by their row in
+    @bboxes.
+    """
+    def __init__(self, bboxes, voxel_size):
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 6)
+        self.voxel_size = voxel_size
+        self.cells = {}
+        if len(self.bboxes) == 0:
+            return
+
+        # Range of voxels overlapped by each box. Boxes that end exactly
+        # on a voxel boundary do not spill over into the next voxel.
+        lo = np.floor(self.bboxes[:, 0:3] / voxel_size).astype(np.int64)
+        hi = np.maximum(
+            np.ceil(self.bboxes[:, 3:6] / voxel_size).astype(np.int64) - 1, lo)
+        spans = hi - lo + 1
+        counts = spans.prod(axis=1)
+
+        # One (voxel, box) pair per voxel of each box
+        box_ids = np.repeat(np.arange(len(self.bboxes)), counts)
+        offsets = np.arange(counts.sum()) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        span = spans[box_ids]
+        voxels = lo[box_ids] + np.stack([
+            offsets // (span[:, 1] * span[:, 2]),
+            offsets // span[:, 2] % span[:, 1],
+            offsets % span[:, 2]], axis=1)
+
+        order = np.lexsort((box_ids, voxels[:, 2], voxels[:, 1], voxels[:, 0]))
+        voxels, box_ids = voxels[order], box_ids[order]
+        starts = np.flatnonzero(np.r_[True, np.any(voxels[1:] != voxels[:-1], axis=1)])
+        for voxel, ids in zip(voxels[starts].tolist(), np.split(box_ids, starts[1:])):
+            self.cells[tuple(voxel)] = ids
+
+    def traverse(self, p1, p2):
+        """
+        Yield the voxels crossed by the segment from @p1 to @p2, in
+        order, following Amanatides and Woo's 3D DDA.
+        """
+        p1 = np.asarray(p1, dtype=np.float64) / self.voxel_size
+        p2 = np.asarray(p2, dtype=np.float64) / self.voxel_size
+        voxel = np.floor(p1).astype(np.int64)
+        last = np.floor(p2).astype(np.int64)
+        direction = p2 - p1
+        step = np.sign(direction).astype(np.int64)
+        t_max = np.full(3, math.inf)
+        t_delta = np.full(3, math.inf)
+        for axis in range(3):
+            if step[axis] != 0:
+                boundary = voxel[axis] + (step[axis] > 0)
+                t_max[axis] = (boundary - p1[axis]) / direction[axis]
+                t_delta[axis] = step[axis] / direction[axis]
+
+        voxel, last, step = voxel.tolist(), last.tolist(), step.tolist()
+        t_max, t_delta = t_max.tolist(), t_delta.tolist()
+        yield tuple(voxel)
+        # A segment crosses at most one voxel per boundary along each axis
+        for n in range(sum(abs(a - b) for a, b in zip(voxel, last))):
+            axis = t_max.index(min(t_max))
+            if t_max[axis] > 1.0:
+                break
+            voxel[axis] += step[axis]
+            t_max[axis] += t_delta[axis]
+            yield tuple(voxel)
+
+    def candidates(self, p1, p2):
+        """
+        Return the ids of the boxes registered in the voxels crossed by
+        the segment from @p1 to @p2, without duplicates.
+        """
+        found = [
+            self.cells[voxel]
+            for voxel in self.traverse(p1, p2) if voxel in self.cells]
+        if len(found) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def intersect(self, p1, p2, eps=1e-9):
+        """
+        Clip the segment from @p1 to @p2 against the boxes it crosses.
+        Returns the ids of the boxes and the (M,2) parameters along the
+        segment (0 at @p1, 1 at @p2) where it enters and leaves each box.
+        Segments that merely touch a box are left out.
+        """
+        ids = self.candidates(p1, p2)
+        p1 = np.asarray(p1, dtype=np.float64)
+        direction = np.asarray(p2, dtype=np.float64) - p1
+        boxes = self.bboxes[ids]
+
+        # Slab test against all candidate boxes at once
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t1 = (boxes[:, 0:3] - p1) / direction
+            t2 = (boxes[:, 3:6] - p1) / direction
+        t_low, t_high = np.minimum(t1, t2), np.maximum(t1, t2)
+        # Along axes the segment is parallel to, it either always or never
+        # lies within the slab. Segments that lie on a face of a box only
+        # touch it, as those that cross it at an edge or a corner.
+        parallel = direction == 0
+        inside = (p1 > boxes[:, 0:3]) & (p1 < boxes[:, 3:6])
+        t_low = np.where(parallel, np.where(inside, -math.inf, math.inf), t_low)
+        t_high = np.where(parallel, np.where(inside, math.inf, -math.inf), t_high)
+        enter = np.maximum(t_low.max(axis=1), 0.0)
+        leave = np.minimum(t_high.min(axis=1), 1.0)
+        hit = leave - enter > eps
+        return ids[hit], np.stack([enter[hit], leave[hit]], axis=1)
+
+
+def segmentBlocks(the_map):
+    """
+    Link the drill hole segments of a level to the blocks of its block
+    model that they cross. Returns a list of (drill, segment, shape,
+    block, p1, p2) tuples: the segment-th segment of the drill-th drill
+    hole of the level crosses the block-th block of its shape-th
+    geological shape, from p1 to p2 (both (3,) points). Ids follow the
+    order of the objects of the level, whatever the files they end up in.
+    """
+    models = [BlockModel.fromShape(shape) for shape in the_map.shapes]
+    bboxes = [model.bboxes() for model in models]
+    if len(bboxes) == 0:
+        return []
+    cube_size = min([model.cube_size for model in models])
+    index = VoxelIndex(np.concatenate(bboxes), cube_size)
+
+    # Shape and block of each box of the index
+    counts = [len(b) for b in bboxes]
+    shape_ids = np.repeat(np.arange(len(counts)), counts).tolist()
+    block_ids = (np.arange(sum(counts)) - \
+        np.repeat(np.cumsum(counts) - counts, counts)).tolist()
+
+    links = []
+    for d, drill in enumerate(the_map.drills):
+        for n, segment in enumerate(drill.segments()):
+            p1, p2 = entities.LineEntity(segment).array()
+            ids, params = index.intersect(p1, p2)
+            direction = p2 - p1
+            for box, (enter, leave) in zip(ids.tolist(), params):
+                links.append((
+                    d, n, shape_ids[box], block_ids[box],
+                    p1 + enter * direction, p1 + leave * direction))
+    return links
+
+
+def segmentDistances(p1, p2, q1, q2):
+    """
+    Distances between the segment from @p1 to @p2 and each of the (N,3)
+    segments from @q1 to @q2, computed from their closest points.
+    """
+    d1 = p2 - p1
+    d2 = q2 - q1
+    r = p1 - q1
+    a = d1.dot(d1)
+    e = (d2 * d2).sum(axis=1)
+    f = (d2 * r).sum(axis=1)
+    b = d2.dot(d1)
+    c = r.dot(d1)
+    denom = a * e - b * b
+
+    # Closest point along the first segment, then along the others,
+    # clamping both to their segments (degenerate segments included)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = np.where(denom > 1e-12, (b * f - c * e) / denom, 0.0)
+        s = np.clip(s, 0.0, 1.0)
+        t = np.where(e > 1e-12, (b * s + f) / e, 0.0)
+        s = np.where((t < 0.0) | (e <= 1e-12), -c / a if a > 1e-12 else 0.0, s)
+        s = np.where(t > 1.0, (b - c) / a if a > 1e-12 else 0.0, s)
+    s = np.clip(s, 0.0, 1.0)
+    t = np.clip(t, 0.0, 1.0)
+    delta = (p1 + s[:, None] * d1) - (q1 + t[:, None] * d2)
+    return np.sqrt((delta * delta).sum(axis=1))
+
+
+class ClearanceGrid:
+    """
+    Uniform 3D grid hash of line segments, used to keep new segments at
+    least @clearance apart from those already added. Segments are split
+    into pieces no longer than @clearance and each piece is hashed by its
+    midpoint into cells twice as large, so that pieces closer than
+    @clearance to a query piece always lie in the 27 cells around it.
+    """
+    def __init__(self, clearance):
+        self.clearance = clearance
+        self.cell_size = 2.0 * clearance
+        self.cells = {}
+        self.starts = np.empty((1024, 3))
+        self.ends = np.empty((1024, 3))
+        self.count = 0
+
+    def pieces(self, p1, p2):
+        """
+        Split the segment from @p1 to @p2 into pieces no longer than the
+        clearance. Returns the (N,3) starts and ends of the pieces.
+        """
+        p1 = np.asarray(p1, dtype=np.float64)
+        p2 = np.asarray(p2, dtype=np.float64)
+        length = np.sqrt(((p2 - p1)**2).sum())
+        num = max(int(math.ceil(length / self.clearance)), 1)
+        t = np.linspace(0.0, 1.0, num + 1)[:, None]
+        points = p1 + t * (p2 - p1)
+        return points[:-1], points[1:]
+
+    def cellOf(self, starts, ends):
+        """
+        Cells of the pieces with the given @starts and @ends.
+        """
+        return [
+            tuple(c) for c in
+            np.floor((starts + ends) / (2.0 * self.cell_size)).astype(np.int64).tolist()]
+
+    def isClear(self, p1, p2):
+        """
+        Tell whether the segment from @p1 to @p2 keeps the clearance
+        from all segments added so far.
+        """
+        starts, ends = self.pieces(p1, p2)
+        for start, end, cell in zip(starts, ends, self.cellOf(starts, ends)):
+            ids = [
+                n
+                for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                for n in self.cells.get(
+                    (cell[0]+dx, cell[1]+dy, cell[2]+dz), [])]
+            if len(ids) == 0:
+                continue
+            distances = segmentDistances(
+                start, end, self.starts[ids], self.ends[ids])
+            if distances.min() < self.clearance:
+                return False
+        return True
+
+    def add(self, p1, p2):
+        """
+        Add the segment from @p1 to @p2 to the grid.
+        """
+        starts, ends = self.pieces(p1, p2)
+        while self.count + len(starts) > len(self.starts):
+            self.starts = np.concatenate([self.starts, np.empty_like(self.starts)])
+            self.ends = np.concatenate([self.ends, np.empty_like(self.ends)])
+        ids = range(self.count, self.count + len(starts))
+        self.starts[ids.start:ids.stop] = starts
+        self.ends[ids.start:ids.stop] = ends
+        self.count += len(starts)
+        for n, cell in zip(ids, self.cellOf(starts, ends)):
+            self.cells.setdefault(cell, []).append(n)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Spatial query workloads. Each level can come with a set of queries sized
+# from its extent (bounding box windows, k nearest neighbors around drill
+# hole collars, shapes that contain blocks, and segments that intersect
+# shapes), along with their expected results, so that spatial databases
+# loaded with the level can be benchmarked and verified at once. Expected
+# results are computed on the solids: convex hulls for the geological
+# shapes and boxes for the blocks.
+
+from collections import OrderedDict
+from scipy.spatial import ConvexHull, cKDTree
+from src import entities
+from src.blockmodel import BlockModel
+from src.output import TABLES, tableFileName
+import numpy as np
+import json
+import os
+
+# Kinds of queries, in the order in which they are generated
+QUERY_TYPES = ["bbox", "knn", "contains", "intersects"]
+
+# Range of the size of bounding box windows, relative to the level extent
+WINDOW_SIZE = (0.02, 0.2)
+
+# Largest k of the nearest neighbor queries
+MAX_K = 10
+
+class WorkloadGenerator:
+    """
+    Generate the queries of a level and compute their results. Rows are
+    identified by their 0-based position within the tables of the level.
+    Queries are drawn from @rng, a numpy.random.RandomState.
+    """
+    def __init__(self, the_map, rng, eps=1e-9):
+        self.the_map = the_map
+        self.rng = rng
+        self.eps = eps
+
+        self.bboxes = OrderedDict()
+        for table in TABLES:
+            groups = entities.rowGroups(
+                table,
+                entities.collect(the_map, table),
+                the_map.elevator)
+            self.bboxes[table] = entities.groupBoundingBoxes(groups)
+        self.extent = entities.extent(np.concatenate(list(self.bboxes.values())))
+
+        # Drill hole collars and end points, segments, and block corners
+        self.points = np.array(
+            [e.array() for e in entities.collect(the_map, "points")]).reshape(-1, 3)
+        self.segments = np.array(
+            [e.array() for e in entities.collect(the_map, "segments")]).reshape(-1, 2, 3)
+        corners = [
+            BlockModel.fromShape(shape).corners() for shape in the_map.shapes]
+        self.corners = np.concatenate(corners) if len(corners) else np.empty((0, 8, 3))
+        self.hulls = [None] * len(the_map.shapes)
+
+        self.point_tree = cKDTree(self.points) if len(self.points) else None
+        self.segment_tree = None
+        if len(self.segments):
+            self.segment_tree = cKDTree(self.segments.mean(axis=1))
+            self.segment_radius = np.sqrt(
+                ((self.segments[:, 1] - self.segments[:, 0])**2).sum(axis=1)).max() / 2
+        self.block_tree = None
+        if len(self.corners):
+            self.block_tree = cKDTree(self.corners.mean(axis=1))
+            self.block_radius = np.sqrt(
+                ((self.corners[:, 6] - self.corners[:, 0])**2).sum(axis=1)).max() / 2
+
+    def hull(self, shape):
+        """
+        Return the half-space equations of the convex hull of the given
+        @shape (a row of geological_shapes), along with its center and
+        the distance from the center to its farthest point.
+        """
+        if self.hulls[shape] is None:
+            points = self.the_map.shapes[shape].points
+            center = points.mean(axis=0)
+            radius = np.sqrt(((points - center)**2).sum(axis=1)).max()
+            self.hulls[shape] = (ConvexHull(points).equations, center, radius)
+        return self.hulls[shape]
+
+    def bboxQuery(self):
+        """
+        A 3D window within the level, with the number of rows of each
+        table whose bounding box overlaps it.
+        """
+        lower, upper = self.extent[0:3], self.extent[3:6]
+        size = (upper - lower) * self.rng.uniform(*WINDOW_SIZE, size=3)
+        start = lower + (upper - lower - size) * self.rng.uniform(size=3)
+        window = np.concatenate([start, start + size])
+        counts = OrderedDict()
+        for table, bboxes in self.bboxes.items():
+            overlap = (bboxes[:, 0:3] <= window[3:6]) & (bboxes[:, 3:6] >= window[0:3])
+            counts[table] = int(overlap.all(axis=1).sum())
+        return {"bbox": window.tolist(), "counts": counts}
+
+    def knnQuery(self):
+        """
+        The k rows of the points table nearest to a drill hole collar.
+        """
+        collar = self.points[2 * self.rng.randint(len(self.points) // 2)]
+        k = min(int(self.rng.randint(1, MAX_K + 1)), len(self.points))
+        distances, ids = self.point_tree.query(collar, k)
+        return {
+            "point": collar.tolist(),
+            "k": k,
+            "ids": np.atleast_1d(ids).tolist(),
+            "distance": float(np.atleast_1d(distances)[-1])
+        }
+
+    def containsQuery(self):
+        """
+        The number of blocks that lie entirely within a geological shape.
+        """
+        shape = int(self.rng.randint(len(self.the_map.shapes)))
+        equations, center, radius = self.hull(shape)
+        ids = np.array(self.block_tree.query_ball_point(
+            center, radius + self.block_radius), dtype=np.int64)
+        corners = self.corners[ids]
+        distances = corners @ equations[:, 0:3].T + equations[:, 3]
+        inside = (distances <= self.eps).all(axis=(1, 2))
+        return {"shape": shape, "count": int(inside.sum())}
+
+    def intersectsQuery(self):
+        """
+        The number of segments that intersect a geological shape.
+        """
+        shape = int(self.rng.randint(len(self.the_map.shapes)))
+        equations, center, radius = self.hull(shape)
+        ids = np.array(self.segment_tree.query_ball_point(
+            center, radius + self.segment_radius), dtype=np.int64)
+        p1 = self.segments[ids, 0]
+        direction = self.segments[ids, 1] - p1
+
+        # Clip each segment against the half-spaces of the hull
+        num = -(p1 @ equations[:, 0:3].T + equations[:, 3])
+        den = direction @ equations[:, 0:3].T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = num / den
+        enter = np.where(den < 0, t, -np.inf).max(axis=1, initial=0.0)
+        leave = np.where(den > 0, t, np.inf).min(axis=1, initial=1.0)
+        outside = ((den == 0) & (num < -self.eps)).any(axis=1)
+        hit = (enter <= leave + self.eps) & ~outside
+        return {"shape": shape, "count": int(hit.sum())}
+
+    def queries(self, count):
+        """
+        Return @count queries of each type, skipping the types that do
+        not apply to the level (e.g., levels without shapes).
+        """
+        functions = OrderedDict([
+            ("bbox", self.bboxQuery),
+            ("knn", self.knnQuery if self.point_tree is not None else None),
+            ("contains", self.containsQuery
+                if self.block_tree is not None else None),
+            ("intersects", self.intersectsQuery
+                if self.segment_tree is not None and len(self.hulls) else None)
+        ])
+        queries = []
+        for query_type, function in functions.items():
+            if function is None or np.isnan(self.extent).any():
+                continue
+            for n in range(count):
+                query = OrderedDict([("id", len(queries)), ("type", query_type)])
+                query.update(function())
+                queries.append(query)
+        return queries
+
+
+def writeQueries(level, the_map, output_dir, count, seed, batch=None):
+    """
+    Write @count queries of each type for @level to @output_dir, drawn
+    from @seed. Queries of a @batch (e.g., a tile) refer to its own
+    files, and are named after it.
+    """
+    print("Exporting results: level {}, queries".format(level))
+    rng = np.random.RandomState(seed % (1 << 32))
+    generator = WorkloadGenerator(the_map, rng)
+    parts = [batch] if batch is not None else []
+    fname = tableFileName("queries", level, "json", *parts)
+    with open(os.path.join(output_dir, fname), "w") as f:
+        json.dump({"level": level, "queries": generator.queries(count)}, f, indent=1)
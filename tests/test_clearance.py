@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests of the distances between segments and of the clearance grid,
+# checked against brute force.
+
+from src.voxels import ClearanceGrid, segmentDistances
+import numpy as np
+
+def sampledDistance(p1, p2, q1, q2, samples=201):
+    """
+    Distance between two segments, as the smallest distance between
+    points sampled along both of them.
+    """
+    t = np.linspace(0.0, 1.0, samples)[:, None]
+    ps = p1 + t * (p2 - p1)
+    qs = q1 + t * (q2 - q1)
+    delta = ps[:, None, :] - qs[None, :, :]
+    return np.sqrt((delta * delta).sum(axis=2)).min()
+
+def test_segment_distances():
+    rng = np.random.RandomState(3)
+    for n in range(100):
+        p1, p2 = rng.uniform(0, 10, (2, 3))
+        q1, q2 = rng.uniform(0, 10, (2, 5, 3))
+        # Parallel and degenerate segments
+        q1[3], q2[3] = p1 + [1, 0, 0], p2 + [1, 0, 0]
+        q2[4] = q1[4]
+        distances = segmentDistances(p1, p2, q1, q2)
+        # Sampling overestimates distances by at most a sampling step
+        step = max(np.linalg.norm(p2 - p1), np.linalg.norm(q2 - q1).max()) / 200
+        for m in range(5):
+            expected = sampledDistance(p1, p2, q1[m], q2[m])
+            assert expected - step <= distances[m] <= expected + 1e-9
+
+def test_degenerate_segment_distances():
+    p = np.array([1.0, 2.0, 3.0])
+    q1 = np.array([[1.0, 2.0, 5.0], [4.0, 6.0, 3.0]])
+    distances = segmentDistances(p, p, q1, q1)
+    assert np.allclose(distances, [2.0, 5.0])
+
+def test_clearance_grid():
+    rng = np.random.RandomState(4)
+    for clearance in [0.5, 2.0]:
+        grid = ClearanceGrid(clearance)
+        added = []
+        for n in range(400):
+            p1 = rng.uniform(0, 20, 3)
+            p2 = p1 + rng.uniform(-5, 5, 3)
+            clear = all(
+                segmentDistances(p1, p2, q1[None, :], q2[None, :])[0] >= clearance
+                for q1, q2 in added)
+            assert grid.isClear(p1, p2) == clear
+            if clear:
+                grid.add(p1, p2)
+                added.append((p1, p2))
+        assert len(added) > 10
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests of the distances of the corridor network across the tiles of a
+# level.
+
+from src.geometry import Point
+from src.network import CorridorNetwork, levelDistances
+from types import SimpleNamespace
+import numpy as np
+
+def tile(origin, cols, gates, elevator=None, width=4, height=2):
+    """
+    Map of a tile of a single row of @cols corridor cells.
+    """
+    cells = [
+        SimpleNamespace(col=col, row=0, pcenter=Point(
+            (origin[0] + col) * width, origin[1] * width, -height * 25))
+        for col in range(cols)]
+    return SimpleNamespace(
+        corridor=cells, origin=origin, cols=cols, rows=1, gates=gates,
+        elevator_coords=elevator, cell_width=width, cell_height=height)
+
+def test_distances_across_tiles():
+    # The elevator is in the first tile, the second one is only reached
+    # through the gate between them
+    first = CorridorNetwork(tile((0, 0), 3, [((2, 0), (3, 0))], (0, 0)), 1)
+    second = CorridorNetwork(tile((3, 0), 3, [((0, 0), (-1, 0))]), 1)
+    distances = levelDistances([first, second])
+    assert np.allclose(distances[0], [50, 54, 58])
+    assert np.allclose(distances[1], [62, 66, 70])
+    assert np.allclose(second.distances(), [-1, -1, -1])
+    assert np.allclose(first.distances(), distances[0])
+
+def test_distances_without_elevator():
+    network = CorridorNetwork(tile((0, 0), 2, []), 0)
+    assert np.allclose(levelDistances([network])[0], [-1, -1])
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests of the bounding volume hierarchy of convex hulls and of the
+# rejection of overlapping shapes.
+
+from src.overlaps import HullBVH, boxesOverlap, rejectOverlaps
+from types import SimpleNamespace
+import numpy as np
+
+def cube(x, y=0.0, z=0.0, size=2.0):
+    """
+    Corners of an axis-aligned cube of the given @size at (@x, @y, @z).
+    """
+    corners = np.array([
+        [i, j, k] for i in [0, 1] for j in [0, 1] for k in [0, 1]], dtype=float)
+    return corners * size + [x, y, z]
+
+def test_candidates():
+    rng = np.random.RandomState(5)
+    for count in [0, 1, 3, 40, 300]:
+        centers = rng.uniform(0, 100, (count, 3))
+        hulls = [c + rng.uniform(-6, 6, (8, 3)) for c in centers]
+        bvh = HullBVH(hulls)
+        expected = [
+            (i, j) for i in range(count) for j in range(i+1, count)
+            if boxesOverlap(bvh.bboxes[i], bvh.bboxes[j])]
+        assert bvh.candidates() == expected
+
+def test_overlaps_leave_touching_hulls_out():
+    bvh = HullBVH([cube(0), cube(2), cube(1)])
+    assert [(i, j) for i, j, center in bvh.overlaps()] == [(0, 2), (1, 2)]
+
+def test_reject_overlaps_order():
+    # A overlaps B and B overlaps C, but A and C are apart
+    a, b, c = cube(0), cube(1), cube(2.5)
+    shapes = lambda *hulls: [SimpleNamespace(points=h) for h in hulls]
+    assert rejectOverlaps(shapes(a, b, c)) == [0, 2]
+    assert rejectOverlaps(shapes(c, b, a)) == [0, 2]
+    assert rejectOverlaps(shapes(b, a, c)) == [0]
+    assert rejectOverlaps(shapes()) == []
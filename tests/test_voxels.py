@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests of the voxel hash, checked against a single voxel that holds all
+# boxes, where every box is a candidate of every segment.
+
+from types import SimpleNamespace
+from src.geometry import Point
+from src.objects import DrillHole
+from src.voxels import VoxelIndex, segmentBlocks
+import numpy as np
+
+# Voxel size large enough to hold all the boxes and segments of the tests
+SINGLE_VOXEL = 1000.0
+
+def assertSameLinks(bboxes, segments, voxel_size):
+    index = VoxelIndex(bboxes, voxel_size)
+    brute = VoxelIndex(bboxes, SINGLE_VOXEL)
+    for p1, p2 in segments:
+        ids, params = index.intersect(p1, p2)
+        expected_ids, expected_params = brute.intersect(p1, p2)
+        assert ids.tolist() == expected_ids.tolist(), (p1, p2)
+        assert np.allclose(params, expected_params), (p1, p2)
+
+def randomBoxes(rng, num, extent, max_size):
+    lo = rng.uniform(0, extent - max_size, (num, 3))
+    return np.concatenate([lo, lo + rng.uniform(0.1, max_size, (num, 3))], axis=1)
+
+def test_random_segments():
+    rng = np.random.RandomState(1)
+    bboxes = randomBoxes(rng, 200, 50.0, 4.0)
+    segments = rng.uniform(0, 50.0, (300, 2, 3))
+    for voxel_size in [0.7, 2.0, 5.0]:
+        assertSameLinks(bboxes, segments, voxel_size)
+
+def test_segments_on_boundaries():
+    # Unit blocks every other lattice position, so that their faces lie
+    # on voxel boundaries, and segments that run along those boundaries,
+    # along faces and edges of the blocks, or through their corners
+    lo = np.array([
+        (i, j, k) for i in range(0, 8, 2) for j in range(0, 8, 2)
+        for k in range(0, 8, 2)], dtype=np.float64)
+    bboxes = np.concatenate([lo, lo + 1], axis=1)
+    segments = []
+    for c in [0.0, 1.0, 2.0, 0.5, 3.0]:
+        segments += [
+            ((c, 0.5, 0.0), (c, 0.5, 8.0)),
+            ((c, 0.0, 0.5), (c, 8.0, 0.5)),
+            ((0.0, c, 0.5), (8.0, c, 0.5)),
+            ((c, c, 0.0), (c, c, 8.0)),
+            ((c, 0.0, c), (c, 8.0, c)),
+            ((0.0, 0.0, c), (8.0, 8.0, c)),
+            ((c, 0.0, 0.0), (c, 8.0, 8.0))]
+    segments += [
+        ((0.0, 0.0, 0.0), (8.0, 8.0, 8.0)),
+        ((1.0, 1.0, 1.0), (2.0, 2.0, 2.0)),
+        ((0.5, 0.5, 0.5), (0.5, 0.5, 1.0)),
+        ((7.0, 7.0, 7.0), (0.0, 0.0, 0.0)),
+        ((4.0, 4.5, 4.5), (6.0, 4.5, 4.5))]
+    rng = np.random.RandomState(2)
+    ends = rng.randint(0, 9, (200, 2, 3)).astype(np.float64)
+    segments += [tuple(s) for s in ends if np.any(s[0] != s[1])]
+    for voxel_size in [1.0, 2.0, 0.5]:
+        assertSameLinks(bboxes, np.array(segments), voxel_size)
+
+def test_segments_on_faces_touch_only():
+    index = VoxelIndex([[0, 0, 0, 1, 1, 1]], 1.0)
+    ids, params = index.intersect((1, 0.5, 0.0), (1, 0.5, 1.0))
+    assert len(ids) == 0
+    ids, params = index.intersect((0.5, 0.5, -1.0), (0.5, 0.5, 2.0))
+    assert ids.tolist() == [0]
+    assert np.allclose(params, [[1/3, 2/3]])
+
+def test_segment_blocks_ids():
+    # Two shapes of two blocks each, and a vertical drill hole that
+    # crosses the second block of the second shape
+    shapes = [
+        SimpleNamespace(
+            seed=Point(x, 0, 0), cube_size=5,
+            block_indexes=np.array([[0, 0, 0], [5, 0, 0]]))
+        for x in [0.0, 100.0]]
+    drill = DrillHole(Point(125.0, 1.0, 10.0), Point(0, 0, -1), 0, 0, None, 4)
+    drill.line.p2 = Point(125.0, 1.0, -10.0)
+    drill.length = 20.0
+    the_map = SimpleNamespace(shapes=shapes, drills=[drill])
+    links = segmentBlocks(the_map)
+    assert [link[0:4] for link in links] == [(0, n, 1, 1) for n in [1, 2, 3]]
+    for link in links:
+        assert -2.5 <= link[4][2] <= 2.5 and -2.5 <= link[5][2] <= 2.5